@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for the Therapy Scheduler
+
+Sweeps instance sizes (generated with generate_data.py or given as input files) and solver
+configurations, runs each combination in a fresh process and records model build time,
+model size, peak memory, solve time, status, objective and bound in a JSON report. A
+previous report can be passed with --compare to flag regressions.
+"""
+
+import json
+import argparse
+import os
+import sys
+import time
+import tempfile
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+import ortools
+
+from generate_data import PRESETS, generate_instance, write_instance
+from therapy_scheduler import TherapyScheduler, max_rss_mb
+
+# Solver configurations: name -> keyword arguments of run_configuration
+CONFIGS = {
+    "cpsat": {"engine": "cpsat", "backend": "slots", "continuity": "linear"},
+    "cpsat-nohint": {"engine": "cpsat", "backend": "slots", "continuity": "linear", "greedy_hint": False},
+    "cpsat-legacy": {"engine": "cpsat", "backend": "slots", "continuity": "legacy"},
+    "intervals": {"engine": "cpsat", "backend": "intervals"},
+    "greedy": {"engine": "greedy"},
+    "lns": {"engine": "lns"},
+    "decompose": {"engine": "decompose"},
+}
+
+def run_configuration(data_file, engine, time_limit, num_workers=None, backend="slots", continuity="linear",
+                      greedy_hint=True):
+    """Run one configuration on one instance and return its measurements.
+    
+    Runs in a fresh worker process so the peak RSS belongs to this run alone. Values
+    that a configuration does not measure, e.g. the build time of the greedy
+    heuristic, which builds no model, are None. CP-SAT starts from the greedy
+    schedule as a hint, as in TherapyScheduler.solve, unless `greedy_hint` is False.
+    """
+    record = {"build_time": None, "num_variables": None, "num_constraints": None, "bound": None}
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        scheduler = TherapyScheduler(data_file)
+        if engine == "cpsat":
+            build_start = time.time()
+            if backend == "intervals":
+                model, X = scheduler.create_interval_model()
+            else:
+                model, X = scheduler.create_model(continuity=continuity)
+            record["build_time"] = time.time() - build_start
+            proto = model.Proto()
+            record["num_variables"] = len(proto.variables)
+            record["num_constraints"] = len(proto.constraints)
+            if greedy_hint:
+                X.add_hints(model, scheduler.greedy_schedule())
+            results = scheduler.solve_model(model, X, time_limit, num_workers=num_workers)
+        elif engine == "greedy":
+            results = scheduler.solve_greedy()
+        elif engine == "lns":
+            results = scheduler.solve_lns(time_limit, num_workers=num_workers)
+        else:
+            results = scheduler.solve_decomposed(time_limit, jobs=1, num_workers=num_workers)
+        if results and engine in ("lns", "decompose"):
+            # Both build CP-SAT models internally and report their size
+            engine_stats = results["lns" if engine == "lns" else "decomposition"]
+            for key in ("build_time", "num_variables", "num_constraints"):
+                record[key] = engine_stats[key]
+    
+    record["status"] = results["status"] if results else "NO_SOLUTION"
+    record["solve_time"] = results["solve_time"] if results else None
+    record["total_ri_minutes"] = results["total_ri_minutes"] if results else None
+    record["objective"] = None
+    if results and "telemetry" in results:
+        record["objective"] = results["telemetry"]["objective_value"]
+        record["bound"] = results["telemetry"]["best_objective_bound"]
+    elif results:
+        record["objective"] = scheduler.objective_value(scheduler.schedule_rows(results["schedule"]))
+        record["bound"] = results.get("decomposition", {}).get("master_bound")
+    record["peak_rss_mb"] = max_rss_mb()
+    return record
+
+def benchmark_instances(args):
+    """List (name, data file, seed) for the instances to benchmark, generating them as needed."""
+    instances = [(os.path.splitext(os.path.basename(path))[0], path, None) for path in args.inputs]
+    sizes = [(preset, PRESETS[preset]) for preset in args.presets]
+    for size in args.sizes:
+        patients, therapists, days = (int(value) for value in size.lower().split('x'))
+        sizes.append((size, {"patients": patients, "therapists": therapists, "types": 3, "days": days}))
+    
+    instances_dir = args.instances_dir or tempfile.mkdtemp(prefix="therapy_benchmark_")
+    for name, size in sizes:
+        for seed in args.seeds:
+            data = generate_instance(size["patients"], size["therapists"], size["days"],
+                                     num_therapist_types=size["types"], slots_per_day=args.slots,
+                                     availability=args.availability, seed=seed)
+            data_file = os.path.join(instances_dir, f"{name}_seed{seed}.json")
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                write_instance(data, data_file)
+            instances.append((name, data_file, seed))
+    return instances
+
+def compare_reports(runs, baseline_file, tolerance):
+    """Return regressions of `runs` against a previous report's runs."""
+    with open(baseline_file, 'r') as f:
+        baseline = {(run["instance"], run["config"], run["seed"]): run for run in json.load(f)["runs"]}
+    
+    regressions = []
+    for run in runs:
+        previous = baseline.get((run["instance"], run["config"], run["seed"]))
+        if not previous:
+            continue
+        label = f"{run['instance']} / {run['config']} / seed {run['seed']}"
+        for metric in ("build_time", "solve_time", "peak_rss_mb"):
+            if run.get(metric) is not None and previous.get(metric) is not None:
+                # Ignore differences below 0.05 s / MB, which are noise
+                if run[metric] > previous[metric] * (1 + tolerance) + 0.05:
+                    regressions.append(f"{label}: {metric} {previous[metric]:.2f} -> {run[metric]:.2f}")
+        if run.get("objective") is not None and previous.get("objective") is not None:
+            if run["objective"] < previous["objective"] - 1e-6:
+                regressions.append(f"{label}: objective {previous['objective']:.2f} -> {run['objective']:.2f}")
+        if previous["status"] == "OPTIMAL" and run["status"] != "OPTIMAL":
+            regressions.append(f"{label}: status {previous['status']} -> {run['status']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the therapy scheduler')
+    parser.add_argument('--presets', nargs='*', default=['tiny', 'small', 'full'], choices=sorted(PRESETS),
+                        help='Generated instance sizes (default: tiny small full)')
+    parser.add_argument('--sizes', nargs='*', default=[],
+                        help='Extra generated sizes as PATIENTSxTHERAPISTSxDAYS, e.g. 40x20x5')
+    parser.add_argument('--inputs', nargs='*', default=[], help='Existing input JSON files to include')
+    parser.add_argument('--configs', nargs='*', default=['cpsat', 'intervals', 'greedy'], choices=sorted(CONFIGS),
+                        help='Solver configurations (default: cpsat intervals greedy)')
+    parser.add_argument('--seeds', nargs='*', type=int, default=[0], help='Generator seeds (default: 0)')
+    parser.add_argument('--slots', type=int, default=32, help='Slots per day of generated instances (default: 32)')
+    parser.add_argument('--availability', type=float, default=0.9,
+                        help='Therapist availability of generated instances (default: 0.9)')
+    parser.add_argument('--time-limit', '-t', type=float, default=60.0, help='Time limit per run in seconds (default: 60)')
+    parser.add_argument('--workers', '-w', type=int, help='Number of CP-SAT search workers (default: all cores)')
+    parser.add_argument('--instances-dir', help='Directory for generated instances (default: a temporary directory)')
+    parser.add_argument('--output', '-o', default='results/benchmark.json',
+                        help='Path to the JSON report (default: results/benchmark.json)')
+    parser.add_argument('--compare', help='Previous JSON report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative slowdown before --compare reports a regression (default: 0.25)')
+    args = parser.parse_args()
+    
+    runs = []
+    spawn = multiprocessing.get_context('spawn')
+    for name, data_file, seed in benchmark_instances(args):
+        for config in args.configs:
+            print(f"Running {config} on {name} (seed {seed})...")
+            base = {"instance": name, "data_file": data_file, "seed": seed, "config": config}
+            try:
+                # A fresh process per run keeps peak memory measurements separate
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                    record = executor.submit(run_configuration, data_file, time_limit=args.time_limit,
+                                             num_workers=args.workers, **CONFIGS[config]).result()
+            except Exception as error:
+                record = {"status": "ERROR", "error": str(error)}
+            runs.append({**base, **record})
+    
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "ortools": ortools.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "time_limit": args.time_limit,
+            "workers": args.workers
+        },
+        "runs": runs
+    }
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    
+    columns = ["instance", "seed", "config", "status", "build_time", "num_variables", "num_constraints",
+               "peak_rss_mb", "solve_time", "objective", "bound"]
+    table = pd.DataFrame(runs).reindex(columns=columns)
+    # Keep the counts integral when some configurations do not report them
+    table[["num_variables", "num_constraints"]] = table[["num_variables", "num_constraints"]].astype("Int64")
+    print()
+    print(table.to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+    print(f"\nBenchmark report saved to {args.output}")
+    
+    if args.compare:
+        regressions = compare_reports(runs, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare}")
+
+if __name__ == "__main__":
+    main()
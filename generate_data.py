@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Synthetic Instance Generator for the Therapy Scheduler
+
+Writes input JSON files in the format read by therapy_scheduler.py (R, A, therapist_type,
+C, E and the lunch window) with a configurable size, availability density and seed, so
+benchmarks can be reproduced and scaled beyond the shipped sample data.
+"""
+
+import json
+import argparse
+import os
+import numpy as np
+
+# Named sizes; tiny, small and full are the sizes of the README performance table
+PRESETS = {
+    "tiny": {"patients": 2, "therapists": 2, "types": 2, "days": 1},
+    "small": {"patients": 3, "therapists": 4, "types": 2, "days": 2},
+    "full": {"patients": 5, "therapists": 6, "types": 3, "days": 5},
+    "medium": {"patients": 20, "therapists": 12, "types": 3, "days": 5},
+    "large": {"patients": 60, "therapists": 40, "types": 3, "days": 7},
+}
+
+def generate_instance(num_patients, num_therapists, num_days, num_therapist_types=3, slots_per_day=32,
+                      slot_length=15, lunch_start=None, lunch_end=None, availability=0.9,
+                      requirement_density=0.8, required_minutes=(30, 45, 60), seed=0):
+    """Generate one valid scheduling instance as a dictionary.
+
+    Therapists are spread round-robin over the therapy types so every type is covered.
+    Each patient needs each type with probability `requirement_density` (at least one
+    type), with the same required minutes, drawn from `required_minutes`, on every day.
+    Therapists are available for about `availability` of their non-lunch slots; the
+    unavailable slots form one out-of-office block per therapist and day.
+    """
+    if num_therapists < num_therapist_types:
+        raise ValueError("Need at least one therapist per therapy type")
+    rng = np.random.default_rng(seed)
+    
+    # Lunch defaults to four slots in the middle of the day
+    if lunch_start is None:
+        lunch_start = slots_per_day // 2
+    if lunch_end is None:
+        lunch_end = min(lunch_start + 3, slots_per_day - 1)
+    
+    # Patient requirements
+    A = (rng.random((num_patients, num_therapist_types)) < requirement_density).astype(int)
+    without = np.flatnonzero(A.sum(axis=1) == 0)
+    A[without, rng.integers(num_therapist_types, size=len(without))] = 1
+    minutes = rng.choice(required_minutes, size=(num_patients, num_therapist_types))
+    R = np.broadcast_to(np.where(A == 1, minutes, 0), (num_days, num_patients, num_therapist_types))
+    
+    # Therapist types and efficiency
+    therapist_type = np.zeros((num_therapists, num_therapist_types), dtype=int)
+    therapist_type[np.arange(num_therapists), rng.permutation(num_therapists) % num_therapist_types] = 1
+    E = np.round(rng.uniform(0.85, 0.95, size=num_therapists), 2)
+    
+    # Availability: one out-of-office block per therapist and day, nothing during lunch
+    C = np.ones((num_therapists, num_days, slots_per_day), dtype=int)
+    C[:, :, lunch_start:lunch_end + 1] = 0
+    work_slots = slots_per_day - (lunch_end - lunch_start + 1)
+    blocked = rng.binomial(work_slots, 1.0 - availability, size=(num_therapists, num_days))
+    for k in range(num_therapists):
+        for d in range(num_days):
+            if blocked[k, d]:
+                start = rng.integers(0, slots_per_day - blocked[k, d] + 1)
+                C[k, d, start:start + blocked[k, d]] = 0
+    
+    return {
+        "num_patients": num_patients,
+        "num_therapist_types": num_therapist_types,
+        "num_therapists": num_therapists,
+        "num_days": num_days,
+        "slots_per_day": slots_per_day,
+        "slot_length": slot_length,
+        "lunch_start": lunch_start,
+        "lunch_end": lunch_end,
+        "R": R.tolist(),
+        "A": A.tolist(),
+        "therapist_type": therapist_type.tolist(),
+        "C": C.tolist(),
+        "E": E.tolist()
+    }
+
+def write_instance(data, output_file):
+    """Write an instance to a JSON file, creating its directory."""
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_file, 'w') as f:
+        json.dump(data, f)
+    print(f"Instance with {data['num_patients']} patients, {data['num_therapists']} therapists and "
+          f"{data['num_days']} days saved to {output_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic therapy scheduling instances')
+    parser.add_argument('--output', '-o', required=True, help='Path to the output JSON file')
+    parser.add_argument('--preset', choices=sorted(PRESETS),
+                        help='Named size; overrides --patients, --therapists, --types and --days')
+    parser.add_argument('--patients', type=int, default=5, help='Number of patients (default: 5)')
+    parser.add_argument('--therapists', type=int, default=6, help='Number of therapists (default: 6)')
+    parser.add_argument('--types', type=int, default=3, help='Number of therapy types (default: 3)')
+    parser.add_argument('--days', type=int, default=5, help='Number of days (default: 5)')
+    parser.add_argument('--slots', type=int, default=32, help='Slots per day (default: 32)')
+    parser.add_argument('--slot-length', type=int, default=15, help='Slot length in minutes (default: 15)')
+    parser.add_argument('--lunch-start', type=int, help='First lunch slot (default: middle of the day)')
+    parser.add_argument('--lunch-end', type=int, help='Last lunch slot (default: lunch start + 3)')
+    parser.add_argument('--availability', type=float, default=0.9,
+                        help='Fraction of non-lunch slots therapists are available (default: 0.9)')
+    parser.add_argument('--requirement-density', type=float, default=0.8,
+                        help='Probability that a patient needs each therapy type (default: 0.8)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    args = parser.parse_args()
+    
+    if args.preset:
+        for name, value in PRESETS[args.preset].items():
+            setattr(args, name, value)
+    
+    data = generate_instance(args.patients, args.therapists, args.days, num_therapist_types=args.types,
+                             slots_per_day=args.slots, slot_length=args.slot_length,
+                             lunch_start=args.lunch_start, lunch_end=args.lunch_end,
+                             availability=args.availability, requirement_density=args.requirement_density,
+                             seed=args.seed)
+    write_instance(data, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -7,30 +7,637 @@ It uses Google's CP-SAT solver to maximize total RI (Reportable and Billable) mi
 while satisfying all constraints for patient treatment and therapist availability.
 """
 
+import ortools
 from ortools.sat.python import cp_model
 import json
+import math
+import gzip
+import hashlib
+import zipfile
 import numpy as np
 import pandas as pd
 import time
 import argparse
+import cProfile
+import resource
 from datetime import datetime, timedelta
 import os
-import shutil
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from collections import Counter, OrderedDict, deque
+import glob
+import traceback
+import sys
+import io
+import copy
+import uuid
+import queue
+import threading
+import socketserver
+import http.server
+
+SCHEDULE_COLUMNS = ["Patient", "Day", "Slot", "Time", "Therapist", "Therapy Type", "RI Minutes"]
+
+# Input scalars, and input arrays with the scalars giving their shape and their storage dtype
+INPUT_SCALARS = ["num_patients", "num_therapist_types", "num_therapists", "num_days", "slots_per_day",
+                 "slot_length", "lunch_start", "lunch_end"]
+INPUT_ARRAYS = {
+    "R": (("num_days", "num_patients", "num_therapist_types"), np.int16),  # Minutes
+    "A": (("num_patients", "num_therapist_types"), np.bool_),
+    "therapist_type": (("num_therapists", "num_therapist_types"), np.bool_),
+    "C": (("num_therapists", "num_days", "slots_per_day"), np.bool_),
+    "E": (("num_therapists",), np.float64)
+}
+
+class AssignmentIndex:
+    """Sparse store of the X[p, k, t, d, s] variables, one per feasible row of `index`, plus auxiliaries."""
+    
+    def __init__(self, index, variables, unit_length):
+        self.index = index
+        self.variables = variables
+        self.unit_length = unit_length
+        self.positions = {key: i for i, key in enumerate(map(tuple, index.tolist()))}
+        self.var_indices = np.array([var.Index() for var in variables], dtype=np.int64)
+        self.auxiliary = []
+    
+    def __len__(self):
+        return len(self.variables)
+    
+    def __contains__(self, key):
+        return key in self.positions
+    
+    def __getitem__(self, key):
+        return self.variables[self.positions[key]]
+    
+    def items(self):
+        """Iterate over ((p, k, t, d, s), variable) pairs."""
+        return zip(map(tuple, self.index.tolist()), self.variables)
+    
+    def select(self, positions):
+        """Return the variables at the given row positions."""
+        return [self.variables[i] for i in positions]
+    
+    def active(self, solver):
+        """Return the (p, k, t, d, s) rows that are set in the solver's solution."""
+        if len(self.variables) == 0:
+            return self.index
+        return self.index[solution_values(solver, self.var_indices) != 0]
+    
+    def define(self, var, rule, key):
+        """Register an auxiliary variable whose value follows from the X values by `rule`, so hints can cover it."""
+        self.auxiliary.append((var, rule, key))
+    
+    def add_hints(self, model, rows):
+        """Hint every variable with its value in a previous schedule of (p, k, t, d, s) rows."""
+        previous = set(map(tuple, rows.tolist()))
+        for key, var in self.items():
+            model.AddHint(var, key in previous)
+        
+        treated = {(p, t, k) for p, k, t, d, s in previous}
+        days = {(p, k, t, d) for p, k, t, d, s in previous}
+        slot_counts = {}
+        for p, k, t, d, s in previous:
+            slot_counts[p, t, d] = slot_counts.get((p, t, d), 0) + 1
+        for var, rule, key in self.auxiliary:
+            if rule == 'treats':
+                value = key in treated
+            elif rule == 'happens':
+                value = key in days
+            elif rule == 'start':
+                slot, before = key
+                value = slot in previous and before not in previous
+            elif rule == 'covered':
+                p, t, d, required = key
+                value = min(required, self.unit_length * slot_counts.get((p, t, d), 0))
+            else:
+                value = False
+            model.AddHint(var, value)
+    
+    def freeze(self, model, rows, cutoff):
+        """Fix every variable before the (day, slot) `cutoff` to `rows`; returns how many cannot be kept."""
+        previous = set(map(tuple, rows.tolist()))
+        for key, var in self.items():
+            if key[3:] < cutoff:
+                model.Add(var == int(key in previous))
+        return sum(1 for key in previous if key[3:] < cutoff and key not in self.positions)
+    
+    def fix_therapists(self, model, therapists):
+        """Allow only therapist `therapists[p, t]` to treat p for t; returns the number of pairs that cannot be kept."""
+        kept = set()
+        for var, rule, key in self.auxiliary:
+            if rule != 'treats' or key[:2] not in therapists:
+                continue
+            if therapists[key[:2]] == key[2]:
+                kept.add(key[:2])
+            else:
+                model.Add(var == 0)
+        return sum(1 for pair in therapists if pair not in kept)
+    
+    def group_by(self, *columns):
+        """Map each distinct key over `columns` to the row positions sharing it."""
+        if len(self.variables) == 0:
+            return {}
+        keys = self.index[:, list(columns)]
+        order = np.lexsort(keys.T[::-1])
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)])
+        groups = np.split(order, starts[1:])
+        return {tuple(sorted_keys[i].tolist()): group for i, group in zip(starts, groups)}
+    
+    def to_cache(self):
+        """Plain data for ModelCache, with each variable replaced by its model index."""
+        return {
+            "index": self.index,
+            "var_indices": self.var_indices,
+            "unit_length": self.unit_length,
+            "auxiliary": [(var.Index(), rule, key) for var, rule, key in self.auxiliary]
+        }
+    
+    @classmethod
+    def from_cache(cls, model, data):
+        """Rebuild the index from to_cache data for a model loaded by ModelCache."""
+        variables = [model.GetBoolVarFromProtoIndex(i) for i in data["var_indices"].tolist()]
+        X = cls(data["index"], variables, data["unit_length"])
+        X.auxiliary = [(model.GetBoolVarFromProtoIndex(i), rule, key) for i, rule, key in data["auxiliary"]]
+        return X
+
+class SessionIntervals:
+    """Optional interval variables of the interval backend, one candidate session per (patient, therapist, type, day)."""
+    
+    def __init__(self, unit_length):
+        self.unit_length = unit_length
+        self.sessions = []
+        self.keys = {}
+        self.ends = {}
+        self.treats = {}
+    
+    def __len__(self):
+        return len(self.sessions)
+    
+    def add(self, key, present, start, length, end):
+        """Record the variables of the candidate session `key` = (p, k, t, d)."""
+        self.keys[key] = len(self.sessions)
+        self.sessions.append((key, present, start, length))
+        self.ends[key] = end
+    
+    def active(self, solver):
+        """Expand present sessions into (p, k, t, d, unit) rows, as AssignmentIndex does."""
+        if not self.sessions:
+            return np.zeros((0, 5), dtype=int)
+        keys = np.array([key for key, _, _, _ in self.sessions], dtype=int)
+        indices = np.array([[present.Index(), start.Index(), length.Index()]
+                            for _, present, start, length in self.sessions], dtype=np.int64)
+        present, start, length = solution_values(solver, indices).T
+        chosen = present != 0
+        keys, start, length = keys[chosen], start[chosen], length[chosen]
+        
+        # One row per unit: repeat each session and offset the start by the position within it
+        repeats = np.repeat(np.arange(len(keys)), length)
+        offsets = np.arange(len(repeats)) - np.repeat(np.cumsum(length) - length, length)
+        rows = np.column_stack([keys[repeats], start[repeats] + offsets])
+        return rows[np.lexsort(rows.T[::-1])] if len(rows) else rows.reshape(-1, 5)
+    
+    @staticmethod
+    def previous_sessions(rows):
+        """Map each (p, k, t, d) in a previous schedule to the (start, length) of its first contiguous run."""
+        units = {}
+        for p, k, t, d, u in rows.tolist():
+            units.setdefault((p, k, t, d), []).append(u)
+        sessions = {}
+        for key, values in units.items():
+            values.sort()
+            length = 1
+            while length < len(values) and values[length] == values[0] + length:
+                length += 1
+            sessions[key] = (values[0], length)
+        return sessions
+    
+    def add_hints(self, model, rows):
+        """Hint every session with its start and length in a previous schedule."""
+        previous = self.previous_sessions(rows)
+        for key, present, start, length in self.sessions:
+            first, size = previous.get(key, (0, 0))
+            model.AddHint(present, key in previous)
+            model.AddHint(start, first)
+            model.AddHint(length, size)
+            model.AddHint(self.ends[key], first + size)
+        treated = {(p, t, k) for p, k, t, d in previous}
+        for key, var in self.treats.items():
+            model.AddHint(var, key in treated)
+    
+    def freeze(self, model, rows, cutoff):
+        """Pin sessions delivered before the (day, unit) `cutoff`; returns the number of sessions that cannot be kept."""
+        cutoff_day, cutoff_unit = cutoff
+        previous = self.previous_sessions(rows)
+        for key, present, start, length in self.sessions:
+            day = key[3]
+            if day > cutoff_day:
+                continue
+            first, size = previous.get(key, (None, 0))
+            if day < cutoff_day or (first is not None and first < cutoff_unit):
+                if first is None:
+                    model.Add(present == 0)
+                    continue
+                model.Add(present == 1)
+                model.Add(start == first)
+                if day < cutoff_day or first + size <= cutoff_unit:
+                    model.Add(length == size)
+                else:
+                    model.Add(length >= cutoff_unit - first)
+            else:
+                model.Add(start >= cutoff_unit).OnlyEnforceIf(present)
+        return sum(1 for key, (first, _) in previous.items()
+                   if (key[3], first) < cutoff and key not in self.keys)
+    
+    def to_cache(self):
+        """Plain data for ModelCache, with each variable replaced by its model index."""
+        return {
+            "unit_length": self.unit_length,
+            "sessions": [(key, present.Index(), start.Index(), length.Index(), self.ends[key].Index())
+                         for key, present, start, length in self.sessions],
+            "treats": [(key, var.Index()) for key, var in self.treats.items()]
+        }
+    
+    @classmethod
+    def from_cache(cls, model, data):
+        """Rebuild the sessions from to_cache data for a model loaded by ModelCache."""
+        X = cls(data["unit_length"])
+        for key, present, start, length, end in data["sessions"]:
+            X.add(key, model.GetBoolVarFromProtoIndex(present), model.GetIntVarFromProtoIndex(start),
+                  model.GetIntVarFromProtoIndex(length), model.GetIntVarFromProtoIndex(end))
+        X.treats = {key: model.GetBoolVarFromProtoIndex(i) for key, i in data["treats"]}
+        return X
+
+class ModelCache:
+    """On-disk LRU cache of built models as .npz files, keyed by a hash of the instance and model options."""
+    
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+    
+    def key(self, scheduler, kind, **options):
+        """Hash the loaded arrays, dimensions, lunch window and model options."""
+        digest = hashlib.sha256()
+        for name in ("R", "A", "therapist_type", "C", "E"):
+            array = np.ascontiguousarray(getattr(scheduler, name))
+            digest.update(f"{name}{array.dtype}{array.shape}".encode())
+            digest.update(array.tobytes())
+        digest.update(repr((scheduler.num_patients, scheduler.num_therapist_types, scheduler.num_therapists,
+                            scheduler.num_days, scheduler.slots_per_day, scheduler.slot_length,
+                            scheduler.lunch_start, scheduler.lunch_end, scheduler.objective_precision,
+                            kind, sorted(options.items()))).encode())
+        # Any change to the model code invalidates the cache
+        with open(__file__, 'rb') as f:
+            digest.update(f.read())
+        digest.update(ortools.__version__.encode())
+        return digest.hexdigest()
+    
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+    
+    def load(self, key, index_class):
+        """Return (model, index, extra) for a cached model, or None on a miss."""
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                model_text = gzip.decompress(entry["model"].tobytes()).decode()
+                meta = json.loads(entry["meta"].tobytes())
+                arrays = {name[len("index_"):]: entry[name] for name in entry.files if name.startswith("index_")}
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        model = cp_model.CpModel()
+        model.Proto().parse_text_format(model_text)
+        # JSON turns the tuple keys of the index into lists
+        index_data = {**json_tuples(meta["index"]), **arrays}
+        return model, index_class.from_cache(model, index_data), meta["extra"]
+    
+    def store(self, key, model, X, extra=None):
+        """Save a built model and its index, then evict entries beyond the size limit."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        text_file = f"{path}.{os.getpid()}.pbtxt"
+        model.ExportToFile(text_file)
+        with open(text_file, 'rb') as f:
+            model_text = gzip.compress(f.read(), 1)
+        os.remove(text_file)
+        index_data = X.to_cache()
+        arrays = {f"index_{name}": value for name, value in index_data.items() if isinstance(value, np.ndarray)}
+        meta = {"index": {name: value for name, value in index_data.items() if not isinstance(value, np.ndarray)},
+                "extra": extra}
+        with atomic_open(path, 'wb') as f:
+            np.savez(f, model=np.frombuffer(model_text, dtype=np.uint8),
+                     meta=np.frombuffer(json.dumps(meta, default=json_value).encode(), dtype=np.uint8), **arrays)
+        self.evict()
+    
+    def evict(self):
+        """Remove least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+class PhaseProfile:
+    """Time, model growth and peak memory of the phases and constraint families of one run, for --profile."""
+    
+    def __init__(self):
+        self.phases = []
+        self.families = []
+        self.presolve = None  # Set by solve_model from the CP-SAT log, see presolve_statistics
+        self.open_peaks = []  # Peak memory so far of the enclosing, still running phases
+    
+    @staticmethod
+    def peak_memory():
+        """Peak resident memory in MB since the last reset."""
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return max_rss_mb()
+    
+    @staticmethod
+    def reset_peak_memory():
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            pass
+    
+    @contextmanager
+    def phase(self, name, model=None):
+        """Record the block as a phase, or as a constraint family of `model` when given."""
+        if self.open_peaks:
+            # Keep the enclosing phase's peak before resetting it
+            self.open_peaks[-1] = max(self.open_peaks[-1], self.peak_memory())
+        self.reset_peak_memory()
+        self.open_peaks.append(0.0)
+        if model is not None:
+            proto = model.Proto()
+            num_variables, num_constraints = len(proto.variables), len(proto.constraints)
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            record = {"name": name, "time": time.time() - start_time}
+            if model is not None:
+                record["num_variables"] = len(proto.variables) - num_variables
+                record["num_constraints"] = len(proto.constraints) - num_constraints
+            peak = max(self.open_peaks.pop(), self.peak_memory())
+            record["peak_memory_mb"] = peak
+            if self.open_peaks:
+                self.open_peaks[-1] = max(self.open_peaks[-1], peak)
+            (self.phases if model is None else self.families).append(record)
+    
+    def report(self):
+        return {"phases": self.phases, "families": self.families, "presolve": self.presolve}
+
+def max_rss_mb():
+    """Peak resident memory of this process in MB; ru_maxrss is in bytes on macOS, KB elsewhere."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 1024
+
+def presolve_statistics(solve_log):
+    """Presolve time, worker count, model size before and after presolve and presolve rule counts, from a CP-SAT log."""
+    sizes = {}
+    rules = {}
+    presolve_time, num_workers = None, None
+    current = None
+    # Log messages may span several lines
+    for line in "\n".join(solve_log).splitlines():
+        if line.startswith(("Initial ", "Presolved ")):
+            current = sizes["before" if line.startswith("Initial ") else "after"] = {
+                "variables": 0, "constraints": 0, "kinds": {}}
+            continue
+        match = re.match(r"#(\w+): ([\d']+)", line)
+        if current is not None and match:
+            count = int(match.group(2).replace("'", ""))
+            if match.group(1) == "Variables":
+                current["variables"] = count
+            else:
+                current["kinds"][match.group(1)] = count
+                current["constraints"] += count
+            continue
+        if not line.startswith(" "):
+            # Indented lines detail the counts above; anything else ends the model summary
+            current = None
+        match = re.search(r"rule '(.*)' was applied ([\d']+) time", line)
+        if match:
+            rules[match.group(1)] = int(match.group(2).replace("'", ""))
+        match = re.search(r'Starting search at ([\d.]+)s(?: with (\d+) workers)?', line)
+        if match and presolve_time is None:
+            presolve_time = float(match.group(1))
+            num_workers = int(match.group(2)) if match.group(2) else None
+    return {"presolve_time": presolve_time, "num_workers": num_workers, "before": sizes.get("before"),
+            "after": sizes.get("after"), "rules": rules}
+
+def json_value(value):
+    """JSON form of the numpy scalars and arrays in cached index data."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    raise TypeError(f"Cannot store {type(value).__name__} in the model cache")
+
+def json_tuples(value):
+    """Turn the lists of parsed JSON back into tuples, recursing into dicts."""
+    if isinstance(value, dict):
+        return {key: json_tuples(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return tuple(json_tuples(item) for item in value)
+    return value
+
+def companion_file(data_file):
+    """Path of the .npz companion of a JSON input file (see convert_instance)."""
+    return os.path.splitext(data_file)[0] + ".npz"
+
+def read_instance(data_file):
+    """Read an instance from a JSON or .npz file, preferring an up-to-date .npz companion of a JSON file."""
+    if not data_file.endswith(".npz"):
+        binary_file = companion_file(data_file)
+        if not os.path.exists(binary_file) or os.path.getmtime(binary_file) < os.path.getmtime(data_file):
+            with open(data_file, 'r') as f:
+                return json.load(f)
+        print(f"Reading {binary_file}, the binary companion of {data_file}")
+        data_file = binary_file
+    with np.load(data_file, allow_pickle=False) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+def validate_instance(data, source):
+    """Check an instance and convert it to compact dtypes; raises ValueError naming `source` and the field."""
+    instance = {}
+    for name in INPUT_SCALARS:
+        if name not in data:
+            raise ValueError(f"{source}: missing '{name}'")
+        value = np.asarray(data[name])
+        if value.shape != () or value.dtype.kind not in "iu":
+            raise ValueError(f"{source}: '{name}' must be an integer, got {data[name]!r}")
+        instance[name] = int(value)
+        if instance[name] < (0 if name.startswith("lunch") else 1):
+            raise ValueError(f"{source}: '{name}' must be {'non-negative' if name.startswith('lunch') else 'positive'}, "
+                             f"got {instance[name]}")
+    if not instance["lunch_start"] <= instance["lunch_end"] < instance["slots_per_day"]:
+        raise ValueError(f"{source}: lunch slots {instance['lunch_start']}-{instance['lunch_end']} must be ordered "
+                         f"and below slots_per_day ({instance['slots_per_day']})")
+    
+    for name, (dimensions, dtype) in INPUT_ARRAYS.items():
+        if name not in data:
+            raise ValueError(f"{source}: missing '{name}'")
+        shape = tuple(instance[dimension] for dimension in dimensions)
+        try:
+            array = np.asarray(data[name])
+        except ValueError:
+            raise ValueError(f"{source}: '{name}' has rows of different lengths, expected shape {shape} "
+                             f"[{', '.join(dimensions)}]")
+        if array.shape != shape:
+            raise ValueError(f"{source}: '{name}' has shape {array.shape}, expected {shape} [{', '.join(dimensions)}]")
+        if array.size and array.dtype.kind not in "biuf":
+            raise ValueError(f"{source}: '{name}' must contain only numbers")
+        
+        if dtype == np.bool_:
+            invalid = (array != 0) & (array != 1)
+            expected = "0 or 1"
+        elif dtype == np.float64:
+            invalid = ~np.isfinite(array) | (array < 0)
+            expected = "a finite number of at least 0"
+        else:
+            invalid = (array != np.round(array)) | (array < 0) | (array > np.iinfo(dtype).max)
+            expected = f"a whole number from 0 to {np.iinfo(dtype).max}"
+        if np.any(invalid):
+            position = tuple(int(i) for i in np.argwhere(invalid)[0])
+            raise ValueError(f"{source}: '{name}'{list(position)} is {array[position]}, expected {expected}")
+        instance[name] = array.astype(dtype, copy=False)
+    return instance
+
+def convert_instance(data_file, output_file=None):
+    """Validate a JSON instance and save it as .npz (default: its companion file); returns the output path."""
+    output_file = output_file or companion_file(data_file)
+    with open(data_file, 'r') as f:
+        data = json.load(f)
+    instance = validate_instance(data, data_file)
+    del data
+    with atomic_open(output_file, 'wb') as f:
+        np.savez(f, **instance)
+    return output_file
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    """Open a temporary file for writing and move it to `path` when done, so readers never see a partial file."""
+    temp_file = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, mode) as f:
+            yield f
+        os.replace(temp_file, path)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def solution_values(values, indices):
+    """Values of the model variables at `indices` in a solver's or callback's current solution."""
+    return np.asarray(values.response_proto.solution, dtype=np.int64)[indices]
+
+def relative_gap(objective, bound):
+    """Relative gap between an objective value and its bound, as CP-SAT defines it."""
+    return abs(objective - bound) / max(1.0, abs(objective))
+
+subproblem_scheduler = None  # TherapyScheduler of a decomposition worker process
+
+def init_subproblem_worker(data_file, data, objective_precision):
+    """Load the instance once per decomposition worker process from its arrays."""
+    global subproblem_scheduler
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        subproblem_scheduler = TherapyScheduler(data_file, data)
+    subproblem_scheduler.objective_precision = objective_precision
+
+def solve_subproblem(patients, day, assignment, continuity, time_limit, hint, scheduler=None):
+    """Solve one (patient cluster, day) subproblem with `hint`; returns status, rows and model size."""
+    scheduler = scheduler or subproblem_scheduler
+    build_start = time.time()
+    restrict = scheduler.subproblem_rows(patients, day, assignment)
+    model, X = scheduler.create_model(continuity=continuity, restrict=restrict)
+    proto = model.Proto()
+    build = (time.time() - build_start, len(proto.variables), len(proto.constraints))
+    X.add_hints(model, hint)
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    solver.parameters.num_workers = 1
+    status = solver.Solve(model)
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return solver.StatusName(status), X.active(solver), build
+    return solver.StatusName(status), hint, build
+
+class IncumbentLogger(cp_model.CpSolverSolutionCallback):
+    """Log each improving solution and optionally write it to disk."""
+    
+    def __init__(self, scheduler, X, start_time, incumbent_file=None, objective_scale=1):
+        super().__init__()
+        self.scheduler = scheduler
+        self.X = X
+        self.start_time = start_time
+        self.incumbent_file = incumbent_file
+        self.objective_scale = objective_scale
+        self.num_solutions = 0
+    
+    def on_solution_callback(self):
+        self.num_solutions += 1
+        elapsed = time.time() - self.start_time
+        objective = self.ObjectiveValue() / self.objective_scale
+        bound = self.BestObjectiveBound() / self.objective_scale
+        # Runs on a CP-SAT search thread, so print to the scheduler's stream explicitly
+        print(f"  Incumbent {self.num_solutions}: objective {objective:.2f}, bound {bound:.2f}, "
+              f"gap {relative_gap(objective, bound):.2%}, {elapsed:.2f}s", file=self.scheduler.output)
+        
+        if self.incumbent_file:
+            results = self.scheduler.build_results(self, self.X, "INCUMBENT", elapsed)
+            with atomic_open(self.incumbent_file) as f:
+                json.dump(results, f, indent=2)
 
 class TherapyScheduler:
     """Class for the therapy scheduling optimization problem."""
     
-    def __init__(self, data_file):
-        """Initialize with data from a JSON file."""
-        self.load_data(data_file)
+    def __init__(self, data_file, data=None):
+        """Initialize with data from a JSON file, or from the `data` dict when given."""
+        self.data_file = data_file
+        self.load_data(data_file, data)
         self.setup_indices()
+        self.time_strings = {}  # Cached slot_times per unit length
+        self.last_status = None  # Status name of the last CP-SAT solve
+        self.objective_precision = 2  # Decimal digits of the objective weights kept as integers
+        self.symmetry_stats = None  # Set by create_model with symmetry breaking
+        self.model_cache = None  # Optional ModelCache for create_model and create_interval_model
+        self.stop_requested = False  # Set by stop()
+        self.active_solver = None  # CpSolver of the running solve_model call
+        self.output = None  # Stream for output of CP-SAT search threads (default: stdout)
+        self.profile = None  # Optional PhaseProfile filled by solve, the model builders and solve_model
         print(f"Loaded data for {self.num_patients} patients, {self.num_therapists} therapists, "
               f"{self.num_therapist_types} therapy types, {self.num_days} days, and {self.slots_per_day} slots per day.")
     
-    def load_data(self, data_file):
-        """Load data from a JSON file."""
-        with open(data_file, 'r') as f:
-            data = json.load(f)
+    def load_data(self, data_file, data=None):
+        """Load and validate data from a JSON or .npz file, or from the `data` dict when given."""
+        if data is None:
+            data = read_instance(data_file)
+        data = validate_instance(data, data_file)
         
         # Basic parameters
         self.num_patients = data['num_patients']
@@ -42,12 +649,12 @@ class TherapyScheduler:
         self.lunch_start = data['lunch_start']
         self.lunch_end = data['lunch_end']
         
-        # Input data arrays
-        self.R = np.array(data['R'])  # Required treatment time [day, patient, therapy_type]
-        self.A = np.array(data['A'])  # Whether patient requires therapy type [patient, therapy_type]
-        self.therapist_type = np.array(data['therapist_type'])  # Therapist type mapping [therapist, type]
-        self.C = np.array(data['C'])  # Therapist availability [therapist, day, slot]
-        self.E = np.array(data['E'])  # Efficiency factors [therapist]
+        # Input data arrays, in the compact dtypes of INPUT_ARRAYS
+        self.R = data['R']  # Required treatment time [day, patient, therapy_type]
+        self.A = data['A']  # Whether patient requires therapy type [patient, therapy_type]
+        self.therapist_type = data['therapist_type']  # Therapist type mapping [therapist, type]
+        self.C = data['C']  # Therapist availability [therapist, day, slot]
+        self.E = data['E']  # Efficiency factors [therapist]
     
     def setup_indices(self):
         """Set up index ranges for model variables."""
@@ -57,252 +664,1236 @@ class TherapyScheduler:
         self.D = range(self.num_days)  # Days
         self.S = range(self.slots_per_day)  # Time slots
     
-    def create_model(self):
-        """Create the optimization model with all constraints."""
+    def feasible_index(self):
+        """The (p, k, t, d, s) rows allowed by constraints 1, 3.1, 5 and 6, in lexicographic order."""
+        lunch = np.zeros(self.slots_per_day, dtype=bool)
+        lunch[self.lunch_start:self.lunch_end + 1] = True
+        eligible = np.argwhere((self.A[:, None, :] == 1) & (self.therapist_type[None, :, :] == 1))  # (p, k, t)
+        available = [np.argwhere((self.C[k] == 1) & ~lunch[None, :]) for k in self.K]  # (d, s) per therapist
+        if len(eligible) == 0:
+            return np.zeros((0, 5), dtype=int)
+        counts = np.array([len(available[k]) for k in eligible[:, 1]], dtype=int)
+        slots = np.concatenate([available[k] for k in eligible[:, 1]])
+        return np.hstack([np.repeat(eligible, counts, axis=0), slots]).astype(int)
+
+    def feasible_rows(self, rows):
+        """The (p, k, t, d, s) rows among `rows` that feasible_index allows, unique and in lexicographic order."""
+        rows = np.unique(np.asarray(rows, dtype=int).reshape(-1, 5), axis=0)
+        p, k, t, d, s = rows.T
+        lunch = (s >= self.lunch_start) & (s <= self.lunch_end)
+        feasible = (self.A[p, t] == 1) & (self.therapist_type[k, t] == 1) & (self.C[k, d, s] == 1) & ~lunch
+        return rows[feasible]
+    
+    def profile_phase(self, name, model=None):
+        """A phase of `profile` (a constraint family when `model` is given), or nothing if not profiling."""
+        return self.profile.phase(name, model) if self.profile else nullcontext()
+    
+    def create_model(self, continuity='linear', restrict=None, symmetry=False):
+        """Create the optimization model with all constraints, optionally restricted to the candidate rows `restrict`."""
+        cache_key, cached = None, None
+        if restrict is None:
+            cache_key, cached = self.load_cached_model('slots', AssignmentIndex, continuity=continuity,
+                                                       symmetry=symmetry)
+        if cached:
+            return cached
+        
         model = cp_model.CpModel()
         
         # Decision Variables: X[p, k, t, d, s]
-        # 1 if patient p gets therapy t from therapist k at slot s on day d
-        X = {}
-        for p in self.P:
-            for k in self.K:
-                for t in self.T:
-                    for d in self.D:
-                        for s in self.S:
-                            X[p, k, t, d, s] = model.NewBoolVar(f'X_p{p}_k{k}_t{t}_d{d}_s{s}')
+        # 1 if patient p gets therapy t from therapist k at slot s on day d.
+        # Only feasible combinations get a variable; everything else is fixed at 0.
+        with self.profile_phase('variables', model):
+            index = self.feasible_index() if restrict is None else self.feasible_rows(restrict)
+            variables = [model.NewBoolVar(f'X_p{p}_k{k}_t{t}_d{d}_s{s}') for p, k, t, d, s in index.tolist()]
+            X = AssignmentIndex(index, variables, self.slot_length)
+            p_idx, k_idx, t_idx, d_idx = index[:, 0], index[:, 1], index[:, 2], index[:, 3]
         
         # Objective: Maximize total RI minutes and satisfaction of treatment requirements
-        objective_terms = []
-        
-        # Regular RI minutes terms
-        for p in self.P:
-            for k in self.K:
-                for t in self.T:
-                    for d in self.D:
-                        for s in self.S:
-                            # Higher weight (5x) for meeting requirements
-                            if self.A[p, t] == 1 and self.R[d, p, t] > 0:
-                                # If this patient needs this therapy on this day, give extra weight
-                                objective_terms.append(X[p, k, t, d, s] * self.slot_length * self.E[k] * 5)
-                            else:
-                                # Regular weight for additional therapy
-                                objective_terms.append(X[p, k, t, d, s] * self.slot_length * self.E[k])
-        
-        # Maximize the objective function
-        model.Maximize(sum(objective_terms))
+        # Higher weight (5x) for meeting requirements, regular weight for additional therapy
+        # Weights are scaled to exact integers, see integer_weights
+        with self.profile_phase('objective', model):
+            required = (self.A[p_idx, t_idx] == 1) & (self.R[d_idx, p_idx, t_idx] > 0)
+            coefficients = self.integer_weights(self.slot_length * self.E)[k_idx] * np.where(required, 5, 1)
+            
+            # Maximize the objective function
+            model.Maximize(cp_model.LinearExpr.WeightedSum(variables, coefficients.tolist()))
         
         # Constraints
-        
-        # 1. Only allow treatments for required therapy types
-        for p in self.P:
-            for t in self.T:
-                if self.A[p, t] == 0:  # Patient doesn't need this therapy type
-                    for k in self.K:
-                        for d in self.D:
-                            for s in self.S:
-                                model.Add(X[p, k, t, d, s] == 0)
+        # 1, 3.1, 5 and 6 are enforced by feasible_index: those variables are never created.
         
         # 2. Upper bound on treatment time
         # This prevents over-treatment beyond what's beneficial
-        for p in self.P:
-            for t in self.T:
-                for d in self.D:
-                    if self.A[p, t] == 1 and self.R[d, p, t] > 0:
-                        # Sum up all slots assigned to this patient for this therapy on this day
-                        treatment_time = sum(X[p, k, t, d, s] * self.slot_length for k in self.K for s in self.S)
-                        # Allow at most 50% more than required (convert to integer)
-                        max_treatment = int(min(self.R[d, p, t] * 1.5, self.slots_per_day * self.slot_length))
-                        model.Add(treatment_time <= max_treatment)
-        
-        # 3. Limitation of Therapists' Accessibility
-        # 3.1 Therapist can only be assigned if they are available
-        for k in self.K:
-            for d in self.D:
-                for s in self.S:
-                    if self.C[k, d, s] == 0:  # Therapist not available
-                        for p in self.P:
-                            for t in self.T:
-                                model.Add(X[p, k, t, d, s] == 0)
+        with self.profile_phase('constraint 2', model):
+            for (p, t, d), positions in X.group_by(0, 2, 3).items():
+                if self.A[p, t] == 1 and self.R[d, p, t] > 0:
+                    # Sum up all slots assigned to this patient for this therapy on this day
+                    treatment_time = cp_model.LinearExpr.Sum(X.select(positions)) * self.slot_length
+                    # Allow at most 50% more than required (convert to integer)
+                    max_treatment = int(min(self.R[d, p, t] * 1.5, self.slots_per_day * self.slot_length))
+                    model.Add(treatment_time <= max_treatment)
         
         # 3.2 Given an available time slot, only one patient can be assigned
-        for k in self.K:
-            for d in self.D:
-                for s in self.S:
-                    model.Add(sum(X[p, k, t, d, s] for p in self.P for t in self.T) <= 1)
+        with self.profile_phase('constraint 3.2', model):
+            for positions in X.group_by(1, 3, 4).values():
+                if len(positions) > 1:
+                    model.AddAtMostOne(X.select(positions))
         
         # 4. Time Conflict: A patient can only receive one therapy at a time
-        for p in self.P:
-            for d in self.D:
-                for s in self.S:
-                    model.Add(sum(X[p, k, t, d, s] for k in self.K for t in self.T) <= 1)
-        
-        # 5. Therapist can only provide therapy of their type
-        for p in self.P:
-            for k in self.K:
-                for t in self.T:
-                    if self.therapist_type[k, t] == 0:  # Therapist k can't provide therapy t
-                        for d in self.D:
-                            for s in self.S:
-                                model.Add(X[p, k, t, d, s] == 0)
-        
-        # 6. Lunch Time Constraint: No therapy during lunch
-        for s in range(self.lunch_start, self.lunch_end + 1):
-            if s < self.slots_per_day:
-                for p in self.P:
-                    for k in self.K:
-                        for t in self.T:
-                            for d in self.D:
-                                model.Add(X[p, k, t, d, s] == 0)
+        with self.profile_phase('constraint 4', model):
+            for positions in X.group_by(0, 3, 4).values():
+                if len(positions) > 1:
+                    model.AddAtMostOne(X.select(positions))
         
         # 7. Patient Continuity: Same therapist for same patient and therapy type across days
-        for p in self.P:
-            for t in self.T:
-                if self.A[p, t] == 0:  # Skip if patient doesn't need this therapy
-                    continue
-                
+        with self.profile_phase('constraint 7', model):
+            by_therapist = X.group_by(0, 2, 1)
+            treats = {}
+            for (p, t), positions in X.group_by(0, 2).items():
                 # Creates a variable for each therapist that might treat this patient
                 treats_patient = {}
-                for k in self.K:
-                    if self.therapist_type[k, t] == 1:  # Only consider therapists of the right type
-                        treats_patient[k] = model.NewBoolVar(f'treats_p{p}_t{t}_k{k}')
-                        
-                        # This therapist treats this patient if they have at least one session
-                        all_sessions = []
-                        for d in self.D:
-                            for s in self.S:
-                                all_sessions.append(X[p, k, t, d, s])
-                        
-                        model.Add(sum(all_sessions) > 0).OnlyEnforceIf(treats_patient[k])
-                        model.Add(sum(all_sessions) == 0).OnlyEnforceIf(treats_patient[k].Not())
+                for k in np.unique(k_idx[positions]).tolist():
+                    treats_patient[k] = treats[p, t, k] = model.NewBoolVar(f'treats_p{p}_t{t}_k{k}')
+                    X.define(treats_patient[k], 'treats', (p, t, k))
+                    
+                    # This therapist treats this patient if they have at least one session
+                    all_sessions = cp_model.LinearExpr.Sum(X.select(by_therapist[p, t, k]))
+                    model.Add(all_sessions > 0).OnlyEnforceIf(treats_patient[k])
+                    model.Add(all_sessions == 0).OnlyEnforceIf(treats_patient[k].Not())
                 
                 # Ensure at most one therapist per patient per therapy type
                 model.Add(sum(treats_patient.values()) <= 1)
         
-        # 8. Continuity: Simplify to ensure there are no gaps in treatment sessions
-        for p in self.P:
+        # 8. Continuity: Ensure there are no gaps in treatment sessions (lunch excepted)
+        with self.profile_phase(f'constraint 8 ({continuity})', model):
+            for (p, k, t, d), positions in X.group_by(0, 1, 2, 3).items():
+                # Only apply for days with a requirement
+                if self.R[d, p, t] == 0:
+                    continue
+                
+                # Slots without a variable (lunch, unavailable) are always empty
+                slots = dict(zip(index[positions, 4].tolist(), X.select(positions)))
+                if continuity == 'legacy':
+                    self.add_legacy_session_continuity(model, X, slots, (p, k, t, d))
+                else:
+                    self.add_session_continuity(model, X, slots, (p, k, t, d))
+        
+        if symmetry:
+            with self.profile_phase('symmetry breaking', model):
+                self.symmetry_stats = self.add_symmetry_breaking(model, treats)
+        
+        self.store_cached_model(cache_key, model, X, symmetry)
+        return model, X
+    
+    def add_session_continuity(self, model, X, slots, key):
+        """Constraint 8 with one start indicator per slot, skipping lunch so a session may continue across it."""
+        p, k, t, d = key
+        starts = []
+        previous, previous_slot = None, None
+        for s in self.S:
+            if self.lunch_start <= s <= self.lunch_end:
+                continue
+            x = slots.get(s)
+            if x is not None:
+                if previous is None:
+                    # Nothing before this slot can have therapy, so it starts a session
+                    starts.append(x)
+                else:
+                    is_start = model.NewBoolVar(f'start_p{p}_k{k}_t{t}_d{d}_s{s}')
+                    model.Add(x <= previous + is_start)
+                    starts.append(is_start)
+                    X.define(is_start, 'start', ((p, k, t, d, s), (p, k, t, d, previous_slot)))
+            previous = x
+            previous_slot = s
+        
+        if len(starts) > 1:
+            model.AddAtMostOne(starts)
+    
+    def add_legacy_session_continuity(self, model, X, slots, key):
+        """Constraint 8 with the original first/last/pair encoding (cubic in slots per day)."""
+        p, k, t, d = key
+        therapy_slots = list(slots.values())
+        
+        # If any therapy happens, create session continuity
+        therapy_happens = model.NewBoolVar(f'therapy_p{p}_k{k}_t{t}_d{d}')
+        X.define(therapy_happens, 'happens', key)
+        model.Add(sum(therapy_slots) > 0).OnlyEnforceIf(therapy_happens)
+        model.Add(sum(therapy_slots) == 0).OnlyEnforceIf(therapy_happens.Not())
+        
+        # Enforce session continuity (no gaps except for lunch)
+        # Create variables to track first and last slots of therapy
+        for s1, x1 in slots.items():
+            is_first = model.NewBoolVar(f'first_p{p}_k{k}_t{t}_d{d}_s{s1}')
+            X.define(is_first, 'off', None)
+        
+            # If this is the first slot, then:
+            # 1. This slot has therapy
+            # 2. All earlier slots have no therapy
+            conditions = [x1] + [x2.Not() for s2, x2 in slots.items() if s2 < s1]
+        
+            # If all conditions are true, this is the first slot
+            model.AddBoolAnd(conditions).OnlyEnforceIf(is_first)
+        
+            # Create last slot variable similarly
+            is_last = model.NewBoolVar(f'last_p{p}_k{k}_t{t}_d{d}_s{s1}')
+            X.define(is_last, 'off', None)
+        
+            conditions = [x1] + [x2.Not() for s2, x2 in slots.items() if s2 > s1]
+        
+            model.AddBoolAnd(conditions).OnlyEnforceIf(is_last)
+        
+            # For each potential first and last slot combination, ensure everything in between has therapy
+            for s2 in slots:
+                if s2 <= s1:
+                    continue
+                # For all slots between first and last (excluding lunch), make sure they have therapy
+                between = [s3 for s3 in range(s1 + 1, s2) if not (self.lunch_start <= s3 <= self.lunch_end)]
+                if any(s3 not in slots for s3 in between):
+                    continue  # An unavailable slot in between: this pair can never hold
+                is_first_last_pair = model.NewBoolVar(f'pair_p{p}_k{k}_t{t}_d{d}_s{s1}_s{s2}')
+                X.define(is_first_last_pair, 'off', None)
+                model.AddBoolAnd([is_first, is_last]).OnlyEnforceIf(is_first_last_pair)
+                for s3 in between:
+                    model.Add(slots[s3] == 1).OnlyEnforceIf(is_first_last_pair)
+    
+    def equivalence_classes(self):
+        """Classes of interchangeable therapists (same type, E and C), each with more than one member."""
+        groups = {}
+        for k in self.K:
+            key = (self.therapist_type[k].tobytes(), float(self.E[k]), self.C[k].tobytes())
+            groups.setdefault(key, []).append(k)
+        return [members for members in groups.values() if len(members) > 1]
+    
+    def add_symmetry_breaking(self, model, treats):
+        """Add value precedence constraints on the `treats` variables within each class of interchangeable therapists."""
+        therapist_classes = self.equivalence_classes()
+        num_constraints = 0
+        for members in therapist_classes:
+            pairs = sorted({(p, t) for p, t, k in treats if k in members})
+            for previous, k in zip(members, members[1:]):
+                earlier = []
+                for pair in pairs:
+                    if (*pair, k) in treats:
+                        model.Add(treats[(*pair, k)] <= sum(earlier))
+                        num_constraints += 1
+                    if (*pair, previous) in treats:
+                        earlier.append(treats[(*pair, previous)])
+        
+        # Each class of size m has m! equivalent copies of every schedule
+        log_copies = sum(math.lgamma(len(members) + 1) for members in therapist_classes) / math.log(10)
+        return {
+            "therapist_classes": [[k + 1 for k in members] for members in therapist_classes],
+            "num_constraints": num_constraints,
+            "log10_symmetric_copies": log_copies
+        }
+    
+    def canonical_rows(self, rows):
+        """Relabel interchangeable therapists in (p, k, t, d, s) rows so they satisfy add_symmetry_breaking."""
+        rows = np.array(rows, dtype=int).reshape(-1, 5)
+        for members in self.equivalence_classes():
+            treated = {k: rows[rows[:, 1] == k] for k in members}
+            first_pair = {k: min(treated[k][:, 0] * self.num_therapist_types + treated[k][:, 2], default=np.inf)
+                          for k in members}
+            order = sorted(members, key=lambda k: first_pair[k])
+            mapping = np.arange(self.num_therapists)
+            mapping[order] = members
+            rows[:, 1] = mapping[rows[:, 1]]
+        return rows
+    
+    def create_interval_model(self, resolution=None, symmetry=False):
+        """Create the interval-based model, with time in units of `resolution` minutes."""
+        resolution = resolution or self.slot_length
+        if self.slot_length % resolution != 0:
+            raise ValueError(f"Resolution {resolution} must divide the slot length {self.slot_length}")
+        cache_key, cached = self.load_cached_model('intervals', SessionIntervals, resolution=resolution,
+                                                   symmetry=symmetry)
+        if cached:
+            return cached
+        units_per_slot = self.slot_length // resolution
+        day_units = self.slots_per_day * units_per_slot
+        
+        model = cp_model.CpModel()
+        X = SessionIntervals(resolution)
+        
+        # Blocked slots: therapist unavailability (3.1) and lunch (6), [therapist, day, slot]
+        blocked = self.C == 0
+        blocked[:, :, self.lunch_start:self.lunch_end + 1] = True
+        
+        therapist_intervals = {(k, d): [] for k in self.K for d in self.D}
+        patient_intervals = {(p, d): [] for p in self.P for d in self.D}
+        objective_terms = []
+        ri_weights = self.integer_weights(resolution * self.E).tolist()
+        
+        # Fixed blocking intervals for each run of blocked slots
+        with self.profile_phase('blocked intervals', model):
             for k in self.K:
+                for d in self.D:
+                    s = 0
+                    while s < self.slots_per_day:
+                        if not blocked[k, d, s]:
+                            s += 1
+                            continue
+                        run_start = s
+                        while s < self.slots_per_day and blocked[k, d, s]:
+                            s += 1
+                        therapist_intervals[k, d].append(model.NewFixedSizeIntervalVar(
+                            run_start * units_per_slot, (s - run_start) * units_per_slot,
+                            f'blocked_k{k}_d{d}_s{run_start}'))
+        
+        with self.profile_phase('sessions and objective', model):
+            for p in self.P:
                 for t in self.T:
+                    if self.A[p, t] == 0:  # 1. Only required therapy types
+                        continue
+                    
+                    # 5. Only therapists of this type, 7. at most one of them per patient and type
+                    treats_patient = {}
+                    for k in self.K:
+                        if self.therapist_type[k, t] == 1 and not blocked[k].all():
+                            treats_patient[k] = model.NewBoolVar(f'treats_p{p}_t{t}_k{k}')
+                            X.treats[p, t, k] = treats_patient[k]
+                    if not treats_patient:
+                        continue
+                    model.AddAtMostOne(treats_patient.values())
+                    
                     for d in self.D:
-                        # Only apply for valid combinations
-                        if self.A[p, t] == 0 or self.therapist_type[k, t] == 0 or self.R[d, p, t] == 0:
+                        # 2. Upper bound on treatment time on days with a requirement
+                        if self.R[d, p, t] > 0:
+                            max_treatment = int(min(self.R[d, p, t] * 1.5, self.slots_per_day * self.slot_length))
+                            weight = 5
+                        else:
+                            max_treatment = self.slots_per_day * self.slot_length
+                            weight = 1
+                        max_units = max_treatment // resolution
+                        if max_units == 0:
                             continue
                         
-                        # Get all slots where this therapy happens
-                        therapy_slots = []
-                        for s in self.S:
-                            therapy_slots.append(X[p, k, t, d, s])
-                        
-                        # If any therapy happens, create session continuity
-                        therapy_happens = model.NewBoolVar(f'therapy_p{p}_k{k}_t{t}_d{d}')
-                        model.Add(sum(therapy_slots) > 0).OnlyEnforceIf(therapy_happens)
-                        model.Add(sum(therapy_slots) == 0).OnlyEnforceIf(therapy_happens.Not())
-                        
-                        # Enforce session continuity (no gaps except for lunch)
-                        # Create variables to track first and last slots of therapy
-                        for s1 in self.S:
-                            if self.lunch_start <= s1 <= self.lunch_end:
-                                continue  # Skip lunch slots
-                                
-                            is_first = model.NewBoolVar(f'first_p{p}_k{k}_t{t}_d{d}_s{s1}')
-                            
-                            # If this is the first slot, then:
-                            # 1. This slot has therapy
-                            # 2. All earlier non-lunch slots have no therapy
-                            conditions = [X[p, k, t, d, s1]]
-                            for s2 in self.S:
-                                if s2 < s1 and not (self.lunch_start <= s2 <= self.lunch_end):
-                                    conditions.append(X[p, k, t, d, s2].Not())
-                            
-                            # If all conditions are true, this is the first slot
-                            model.AddBoolAnd(conditions).OnlyEnforceIf(is_first)
-                            
-                            # Create last slot variable similarly
-                            is_last = model.NewBoolVar(f'last_p{p}_k{k}_t{t}_d{d}_s{s1}')
+                        for k, treats in treats_patient.items():
+                            if blocked[k, d].all():
+                                continue
+                            name = f'p{p}_k{k}_t{t}_d{d}'
+                            present = model.NewBoolVar(f'present_{name}')
+                            start = model.NewIntVar(0, day_units, f'start_{name}')
+                            length = model.NewIntVar(0, max_units, f'length_{name}')
+                            end = model.NewIntVar(0, day_units, f'end_{name}')
+                            interval = model.NewOptionalIntervalVar(start, length, end, present, f'session_{name}')
+                            model.AddImplication(present, treats)
+                            model.Add(length >= 1).OnlyEnforceIf(present)
+                            model.Add(length == 0).OnlyEnforceIf(present.Not())
                             
-                            conditions = [X[p, k, t, d, s1]]
-                            for s2 in self.S:
-                                if s2 > s1 and not (self.lunch_start <= s2 <= self.lunch_end):
-                                    conditions.append(X[p, k, t, d, s2].Not())
-                            
-                            model.AddBoolAnd(conditions).OnlyEnforceIf(is_last)
-                            
-                            # For each potential first and last slot combination, ensure everything in between has therapy
-                            for s2 in self.S:
-                                if s2 > s1 and not (self.lunch_start <= s1 <= self.lunch_end) and not (self.lunch_start <= s2 <= self.lunch_end):
-                                    is_first_last_pair = model.NewBoolVar(f'pair_p{p}_k{k}_t{t}_d{d}_s{s1}_s{s2}')
-                                    model.AddBoolAnd([is_first, is_last]).OnlyEnforceIf(is_first_last_pair)
-                                    
-                                    # For all slots between first and last (excluding lunch), make sure they have therapy
-                                    for s3 in range(s1 + 1, s2):
-                                        if not (self.lunch_start <= s3 <= self.lunch_end):
-                                            model.Add(X[p, k, t, d, s3] == 1).OnlyEnforceIf(is_first_last_pair)
+                            therapist_intervals[k, d].append(interval)
+                            patient_intervals[p, d].append(interval)
+                            objective_terms.append(length * (ri_weights[k] * weight))
+                            X.add((p, k, t, d), present, start, length, end)
+            
+            # Maximize RI minutes, 5x weight for meeting requirements
+            model.Maximize(sum(objective_terms))
+        
+        # 3.2 One patient per therapist at a time, outside blocked time
+        with self.profile_phase('constraint 3.2', model):
+            for intervals in therapist_intervals.values():
+                if len(intervals) > 1:
+                    model.AddNoOverlap(intervals)
+        
+        # 4. One therapy per patient at a time
+        with self.profile_phase('constraint 4', model):
+            for intervals in patient_intervals.values():
+                if len(intervals) > 1:
+                    model.AddNoOverlap(intervals)
+        
+        if symmetry:
+            with self.profile_phase('symmetry breaking', model):
+                self.symmetry_stats = self.add_symmetry_breaking(model, X.treats)
         
+        self.store_cached_model(cache_key, model, X, symmetry)
         return model, X
     
-    def solve_model(self, model, X, time_limit=300.0):
+    def load_cached_model(self, kind, index_class, **options):
+        """Look up a built model in `model_cache`; returns the cache key and (model, X) on a hit, else None."""
+        if not self.model_cache:
+            return None, None
+        start_time = time.time()
+        key = self.model_cache.key(self, kind, **options)
+        cached = self.model_cache.load(key, index_class)
+        if cached is None:
+            return key, None
+        model, X, extra = cached
+        self.symmetry_stats = extra["symmetry_stats"]
+        print(f"Loaded {kind} model from cache in {time.time() - start_time:.2f} seconds")
+        return key, (model, X)
+    
+    def store_cached_model(self, key, model, X, symmetry):
+        """Save a freshly built model under `key` from load_cached_model, if caching."""
+        if key:
+            self.model_cache.store(key, model, X, {"symmetry_stats": self.symmetry_stats if symmetry else None})
+    
+    def stop(self):
+        """Stop the running CP-SAT search and skip later ones; safe to call from another thread."""
+        self.stop_requested = True
+        solver = self.active_solver
+        if solver:
+            solver.StopSearch()
+    
+    def solve_model(self, model, X, time_limit=300.0, num_workers=None, relative_gap=None,
+                    absolute_gap=None, incumbent_file=None, objective_scale=None):
         """Solve the optimization model."""
+        objective_scale = objective_scale or self.objective_scale
         solver = cp_model.CpSolver()
         solver.parameters.max_time_in_seconds = time_limit
+        if num_workers:
+            solver.parameters.num_workers = num_workers
+        if relative_gap is not None:
+            solver.parameters.relative_gap_limit = relative_gap
+        if absolute_gap is not None:
+            solver.parameters.absolute_gap_limit = absolute_gap * objective_scale
+        
+        # Capture the search log to read presolve time from it
+        solve_log = []
+        solver.parameters.log_search_progress = True
+        solver.parameters.log_to_stdout = False
+        solver.log_callback = solve_log.append
         
+        self.active_solver = solver
+        if self.stop_requested:
+            print("Stopped before the optimization started")
+            return None
         print(f"Starting optimization with {time_limit} seconds time limit...")
         start_time = time.time()
-        status = solver.Solve(model)
+        callback = IncumbentLogger(self, X, start_time, incumbent_file, objective_scale)
+        status = solver.Solve(model, callback)
+        self.active_solver = None
         solve_time = time.time() - start_time
+        self.last_status = solver.StatusName(status)
+        presolve = presolve_statistics(solve_log)
+        if self.profile:
+            self.profile.presolve = presolve
         print(f"Optimization completed in {solve_time:.2f} seconds with status: {solver.StatusName(status)}")
         
         if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
-            # Calculate objective value
-            total_ri_minutes = 0
-            schedule_data = []
-            for p in self.P:
-                for k in self.K:
-                    for t in self.T:
-                        for d in self.D:
-                            for s in self.S:
-                                if solver.Value(X[p, k, t, d, s]) > 0:
-                                    total_ri_minutes += self.slot_length * self.E[k]
-                                    schedule_data.append({
-                                        "Patient": p + 1,
-                                        "Day": d + 1,
-                                        "Slot": s + 1,
-                                        "Time": self.format_time(s),
-                                        "Therapist": k + 1,
-                                        "Therapy Type": t + 1,
-                                        "RI Minutes": self.slot_length * self.E[k]
-                                    })
+            results = self.build_results(solver, X, solver.StatusName(status), solve_time)
+            results["telemetry"] = self.solver_telemetry(model, solver, presolve, callback.num_solutions,
+                                                         objective_scale)
             
             # Print results
-            print(f"Total RI Minutes: {total_ri_minutes}")
-            print(f"Average RI Minutes Per Patient: {total_ri_minutes / self.num_patients:.2f}")
+            print(f"Total RI Minutes: {results['total_ri_minutes']}")
+            print(f"Average RI Minutes Per Patient: {results['average_ri_minutes']:.2f}")
             
-            return {
-                "status": solver.StatusName(status),
-                "total_ri_minutes": total_ri_minutes,
-                "average_ri_minutes": total_ri_minutes / self.num_patients,
-                "solve_time": solve_time,
-                "schedule": schedule_data
-            }
+            return results
         else:
             print(f"Failed to find a solution. Status: {solver.StatusName(status)}")
             return None
     
-    def format_time(self, slot):
+    def add_coverage(self, model, X):
+        """Add requirement coverage, the scheduled minutes capped at R, and return its sum."""
+        covered = []
+        for (p, t, d), positions in X.group_by(0, 2, 3).items():
+            required = int(self.R[d, p, t]) if self.A[p, t] == 1 else 0
+            if required > 0:
+                var = model.NewIntVar(0, required, f'covered_p{p}_t{t}_d{d}')
+                model.Add(var <= cp_model.LinearExpr.Sum(X.select(positions)) * X.unit_length)
+                X.define(var, 'covered', (p, t, d, required))
+                covered.append(var)
+        return cp_model.LinearExpr.Sum(covered)
+    
+    def solve_lexicographic(self, model, X, time_limit=300.0, num_workers=None, relative_gap=None,
+                            absolute_gap=None, incumbent_file=None):
+        """Maximize requirement coverage, then RI minutes with coverage kept, instead of the 5x weighted objective."""
+        start_time = time.time()
+        coverage = self.add_coverage(model, X)
+        
+        print("Phase 1: maximizing requirement coverage...")
+        model.Maximize(coverage)
+        phase1 = self.solve_model(model, X, time_limit / 2, num_workers=num_workers, objective_scale=1)
+        if not phase1:
+            return None
+        covered = int(round(phase1["telemetry"]["objective_value"]))
+        print(f"Phase 1 covered {covered} of {int(self.R[self.R > 0].sum())} required minutes")
+        
+        print("Phase 2: maximizing RI minutes with coverage fixed...")
+        model.Add(coverage >= covered)
+        weights = self.integer_weights(X.unit_length * self.E)[X.index[:, 1]]
+        model.Maximize(cp_model.LinearExpr.WeightedSum(X.variables, weights.tolist()))
+        model.ClearHints()
+        X.add_hints(model, self.schedule_rows(phase1["schedule"]))
+        remaining = max(1.0, time_limit - (time.time() - start_time))
+        results = self.solve_model(model, X, remaining, num_workers=num_workers, relative_gap=relative_gap,
+                                   absolute_gap=absolute_gap, incumbent_file=incumbent_file)
+        if not results:
+            results = phase1
+        results["solve_time"] = time.time() - start_time
+        results["lexicographic"] = {
+            "covered_minutes": covered,
+            "required_minutes": int(self.R[self.R > 0].sum()),
+            "phase1_status": phase1["status"],
+            "phase1_time": phase1["solve_time"],
+            "phase1_bound": phase1["telemetry"]["best_objective_bound"]
+        }
+        return results
+    
+    def build_results(self, values, X, status, solve_time):
+        """Build the results dictionary from a solver or solution callback."""
+        return self.results_from_rows(X.active(values), X.unit_length, status, solve_time)
+    
+    def results_from_rows(self, rows, unit_length, status, solve_time):
+        """Build the results dictionary from (p, k, t, d, s) rows of `unit_length` minutes."""
+        p, k, t, d, s = np.asarray(rows, dtype=int).reshape(-1, 5).T
+        minutes = unit_length * self.E[k]
+        # fsum rounds once, so the total matches the RI Minutes column exactly
+        total_ri_minutes = math.fsum(minutes)
+        schedule = pd.DataFrame({
+            "Patient": p + 1,
+            "Day": d + 1,
+            "Slot": s + 1,
+            "Time": self.slot_times(unit_length)[s],
+            "Therapist": k + 1,
+            "Therapy Type": t + 1,
+            "RI Minutes": minutes
+        })
+        
+        return {
+            "status": status,
+            "total_ri_minutes": total_ri_minutes,
+            "average_ri_minutes": total_ri_minutes / self.num_patients,
+            "solve_time": solve_time,
+            "unit_length": unit_length,  # Minutes per `Slot` of the schedule
+            "schedule": schedule.to_dict('records')
+        }
+    
+    def slot_times(self, unit_length=None):
+        """Time strings for every slot (or `unit_length`-minute unit) of a day, computed once."""
+        unit_length = unit_length or self.slot_length
+        if unit_length not in self.time_strings:
+            units = self.slots_per_day * self.slot_length // unit_length
+            self.time_strings[unit_length] = np.array([self.format_time(u, unit_length) for u in range(units)])
+        return self.time_strings[unit_length]
+    
+    def solver_telemetry(self, model, solver, presolve, num_solutions, objective_scale=None):
+        """Collect model size and search statistics for the results file."""
+        objective_scale = objective_scale or self.objective_scale
+        proto = model.Proto()
+        
+        objective = solver.ObjectiveValue() / objective_scale
+        bound = solver.BestObjectiveBound() / objective_scale
+        return {
+            "num_variables": len(proto.variables),
+            "num_constraints": len(proto.constraints),
+            # The parameter is 0 when CP-SAT picks the worker count itself
+            "num_workers": presolve["num_workers"] or solver.parameters.num_workers,
+            "presolve_time": presolve["presolve_time"],
+            "wall_time": solver.WallTime(),
+            "deterministic_time": solver.ResponseProto().deterministic_time,
+            "num_branches": solver.NumBranches(),
+            "num_conflicts": solver.NumConflicts(),
+            "num_solutions": num_solutions,
+            "objective_value": objective,
+            "best_objective_bound": bound,
+            "gap": relative_gap(objective, bound)
+        }
+    
+    @staticmethod
+    def fit_session(free, length):
+        """Best-fit (start, size) window for a session of `length` slots in a boolean `free` row."""
+        edges = np.flatnonzero(np.diff(np.r_[0, free.astype(np.int8), 0]))
+        starts, runs = edges[0::2], edges[1::2] - edges[0::2]
+        if len(runs) == 0:
+            return 0, 0
+        fits = np.flatnonzero(runs >= length)
+        if len(fits):
+            i = fits[np.argmin(runs[fits])]
+            return int(starts[i]), int(length)
+        i = np.argmax(runs)
+        return int(starts[i]), int(runs[i])
+    
+    def greedy_schedule(self, assignment=None):
+        """Construct a feasible schedule without a solver, optionally under a [patient, type] therapist `assignment`."""
+        lunch = np.zeros(self.slots_per_day, dtype=bool)
+        lunch[self.lunch_start:self.lunch_end + 1] = True
+        positions = np.flatnonzero(~lunch)  # Sessions are contiguous in these slots
+        therapist_free = (self.C == 1)[:, :, positions]  # [therapist, day, position]
+        patient_free = np.ones((self.num_patients, self.num_days, len(positions)), dtype=bool)
+        _, _, cap = self.slot_capacities()
+        
+        fixed = assignment is not None
+        if fixed:
+            assignment = np.asarray(assignment, dtype=int).copy()
+        else:
+            assignment = np.full((self.num_patients, self.num_therapist_types), -1, dtype=int)
+        candidates = {t: [k for k in self.K if self.therapist_type[k, t] == 1] for t in self.T}
+        pairs = sorted(zip(*np.nonzero(self.A)), key=lambda pt: -self.R[:, pt[0], pt[1]].sum())
+        if fixed:
+            pairs = [(p, t) for p, t in pairs if assignment[p, t] >= 0]
+        rows = []
+        
+        for required in (True, False):
+            for p, t in pairs:
+                days = [d for d in self.D if (self.R[d, p, t] > 0) == required and cap[p, t, d] > 0]
+                if not days:
+                    continue
+                
+                # Score every candidate therapist by the longest free run per day, capped
+                options = [assignment[p, t]] if assignment[p, t] >= 0 else candidates[t]
+                free = therapist_free[np.ix_(options, days)] & patient_free[p, days][None]
+                run = longest = np.zeros(free.shape[:2], dtype=int)
+                for j in range(free.shape[2]):
+                    run = (run + 1) * free[:, :, j]
+                    longest = np.maximum(longest, run)
+                value = np.minimum(longest, cap[p, t, days]).sum(axis=1) * self.E[options]
+                if value.max() <= 0:
+                    continue
+                
+                k = options[int(np.argmax(value))]
+                assignment[p, t] = k
+                for d in days:
+                    start, size = self.fit_session(therapist_free[k, d] & patient_free[p, d], cap[p, t, d])
+                    therapist_free[k, d, start:start + size] = False
+                    patient_free[p, d, start:start + size] = False
+                    rows.extend((p, k, t, d, s) for s in positions[start:start + size].tolist())
+        
+        rows = np.array(rows, dtype=int).reshape(-1, 5)
+        return rows[np.lexsort(rows.T[::-1])] if len(rows) else rows
+    
+    def solve_greedy(self):
+        """Solve with the greedy construction heuristic only."""
+        print("Starting greedy construction...")
+        start_time = time.time()
+        rows = self.greedy_schedule()
+        solve_time = time.time() - start_time
+        print(f"Greedy construction completed in {solve_time:.2f} seconds, objective {self.objective_value(rows):.2f}")
+        
+        results = self.results_from_rows(rows, self.slot_length, "FEASIBLE", solve_time)
+        print(f"Total RI Minutes: {results['total_ri_minutes']}")
+        print(f"Average RI Minutes Per Patient: {results['average_ri_minutes']:.2f}")
+        return results
+    
+    def lns_neighborhood(self, kind, index, rows, rng):
+        """Boolean mask over the model rows `index` that one LNS iteration frees."""
+        if kind == 'therapist':
+            k = rng.integers(self.num_therapists)
+            treated = rows[rows[:, 1] == k]
+            pair_ids = treated[:, 0] * self.num_therapist_types + treated[:, 2]
+            return (index[:, 1] == k) | np.isin(index[:, 0] * self.num_therapist_types + index[:, 2], pair_ids)
+        if kind == 'day':
+            return index[:, 3] == rng.integers(self.num_days)
+        group = rng.choice(self.num_patients, size=max(1, self.num_patients // 5), replace=False)
+        return np.isin(index[:, 0], group)
+    
+    def solve_lns(self, time_limit=300.0, continuity='linear', num_workers=None, seed=0, step_time_limit=5.0):
+        """Large Neighborhood Search starting from the greedy schedule."""
+        start_time = time.time()
+        rng = np.random.default_rng(seed)
+        rows = self.greedy_schedule()
+        initial_objective = best_objective = self.objective_value(rows)
+        print(f"Greedy start objective {best_objective:.2f} after {time.time() - start_time:.2f} seconds")
+        
+        build_start = time.time()
+        model, X = self.create_model(continuity=continuity)
+        build_time = time.time() - build_start
+        var_indices = X.var_indices.tolist()
+        iterations = improvements = 0
+        
+        print(f"Starting LNS with {time_limit} seconds time limit...")
+        while time.time() - start_time < time_limit and not self.stop_requested:
+            iterations += 1
+            kind = rng.choice(['therapist', 'day', 'patients'])
+            free = self.lns_neighborhood(kind, X.index, rows, rng)
+            current = np.zeros(len(X), dtype=bool)
+            current[[X.positions[key] for key in map(tuple, rows.tolist())]] = True
+            
+            # Fix everything outside the neighborhood through the variable domains of a clone
+            submodel = model.Clone()
+            proto = submodel.Proto()
+            for position in np.flatnonzero(~free).tolist():
+                domain = proto.variables[var_indices[position]].domain
+                domain[0] = domain[1] = int(current[position])
+            X.add_hints(submodel, rows)
+            
+            solver = cp_model.CpSolver()
+            solver.parameters.max_time_in_seconds = min(step_time_limit, max(0.1, time_limit - (time.time() - start_time)))
+            if num_workers:
+                solver.parameters.num_workers = num_workers
+            status = solver.Solve(submodel)
+            if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                continue
+            
+            candidate = X.active(solver)
+            objective = self.objective_value(candidate)
+            if objective >= best_objective - 1e-6:
+                if objective > best_objective + 1e-6:
+                    improvements += 1
+                    print(f"  LNS iteration {iterations} ({kind}): objective {objective:.2f}, "
+                          f"{time.time() - start_time:.2f}s")
+                rows, best_objective = candidate, objective
+        
+        solve_time = time.time() - start_time
+        print(f"LNS completed in {solve_time:.2f} seconds: {iterations} iterations, {improvements} improvements")
+        results = self.results_from_rows(rows, self.slot_length, "FEASIBLE", solve_time)
+        results["lns"] = {
+            "iterations": iterations,
+            "improvements": improvements,
+            "initial_objective": initial_objective,
+            "objective_value": best_objective,
+            "build_time": build_time,
+            "num_variables": len(model.Proto().variables),
+            "num_constraints": len(model.Proto().constraints)
+        }
+        print(f"Total RI Minutes: {results['total_ri_minutes']}")
+        print(f"Average RI Minutes Per Patient: {results['average_ri_minutes']:.2f}")
+        return results
+    
+    @staticmethod
+    def schedule_rows(schedule):
+        """Convert a `schedule` list of dicts to an (n x 5) array of 0-based (p, k, t, d, s) rows."""
+        rows = [(entry["Patient"] - 1, entry["Therapist"] - 1, entry["Therapy Type"] - 1,
+                 entry["Day"] - 1, entry["Slot"] - 1) for entry in schedule]
+        return np.array(rows, dtype=int).reshape(-1, 5)
+    
+    def load_schedule(self, schedule_file, unit_length=None):
+        """Load the schedule rows of a previous results JSON in slots of `unit_length` minutes."""
+        unit_length = unit_length or self.slot_length
+        with open(schedule_file, 'r') as f:
+            previous = json.load(f)
+        rows = self.schedule_rows(previous["schedule"])
+        previous_unit = previous.get("unit_length", self.slot_length)
+        if previous_unit != unit_length:
+            rows = self.convert_units(rows, previous_unit, unit_length)
+            print(f"Converted the previous schedule from {previous_unit}-minute to {unit_length}-minute slots")
+        limits = np.array([self.num_patients, self.num_therapists, self.num_therapist_types, self.num_days])
+        inside = np.all(rows[:, :4] < limits, axis=1)
+        if not inside.all():
+            print(f"Ignoring {np.count_nonzero(~inside)} previous schedule entries outside this instance")
+        return rows[inside]
+    
+    @staticmethod
+    def convert_units(rows, from_length, to_length):
+        """Convert (p, k, t, d, s) rows from slots of `from_length` to `to_length` minutes."""
+        if from_length % to_length == 0:
+            # Split every slot into whole finer units
+            factor = from_length // to_length
+            rows = np.repeat(rows, factor, axis=0)
+            rows[:, 4] = rows[:, 4] * factor + np.tile(np.arange(factor), len(rows) // factor)
+            return rows
+        if to_length % from_length == 0:
+            # Merge units, which is exact only when every coarse slot is fully used
+            factor = to_length // from_length
+            merged = rows.copy()
+            merged[:, 4] //= factor
+            keys, counts = np.unique(merged, axis=0, return_counts=True)
+            if np.all(counts == factor):
+                return keys
+        raise ValueError(f"The previous schedule uses {from_length}-minute slots and cannot be converted "
+                         f"exactly to {to_length}-minute slots")
+    
+    def compare_schedules(self, previous, current):
+        """Count slot assignments and (patient, therapy type, day) sessions that differ between two schedules."""
+        previous_set = set(map(tuple, previous.tolist()))
+        current_set = set(map(tuple, current.tolist()))
+        
+        def sessions(rows):
+            grouped = {}
+            for p, k, t, d, s in rows:
+                grouped.setdefault((p, t, d), set()).add((k, s))
+            return grouped
+        
+        previous_sessions = sessions(previous_set)
+        current_sessions = sessions(current_set)
+        all_sessions = previous_sessions.keys() | current_sessions.keys()
+        return {
+            "slots_kept": len(previous_set & current_set),
+            "slots_added": len(current_set - previous_set),
+            "slots_removed": len(previous_set - current_set),
+            "sessions_total": len(all_sessions),
+            "sessions_changed": sum(1 for key in all_sessions
+                                    if previous_sessions.get(key) != current_sessions.get(key))
+        }
+    
+    def objective_value(self, rows):
+        """Weighted objective of create_model for (p, k, t, d, s) slot rows."""
+        p, k, t, d = rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3]
+        weights = np.where(self.R[d, p, t] > 0, 5, 1)
+        return float(np.sum(self.slot_length * self.E[k] * weights))
+    
+    @property
+    def objective_scale(self):
+        """Factor between the integer objective of the models and weighted minutes."""
+        return 10 ** self.objective_precision
+    
+    def integer_weights(self, weights):
+        """Scale objective weights to integers, keeping `objective_precision` decimal digits."""
+        scaled = np.asarray(weights, dtype=float) * self.objective_scale
+        rounded = np.rint(scaled).astype(np.int64)
+        if not np.allclose(scaled, rounded, rtol=0, atol=1e-6):
+            print(f"Warning: objective weights need more than {self.objective_precision} decimal digits "
+                  f"and are rounded; increase the objective precision")
+        return rounded
+    
+    def slot_capacities(self):
+        """Per-day slot capacities of therapists, days and (patient, type) pairs for the decomposition."""
+        lunch = np.zeros(self.slots_per_day, dtype=bool)
+        lunch[self.lunch_start:self.lunch_end + 1] = True
+        available = ((self.C == 1) & ~lunch).sum(axis=2)
+        day_slots = int(np.count_nonzero(~lunch))
+        max_treatment = np.minimum(self.R * 1.5, self.slots_per_day * self.slot_length).astype(int)
+        cap = np.where(self.R > 0, max_treatment // self.slot_length, day_slots).transpose(1, 2, 0)
+        cap = np.where(self.A[:, :, None] == 1, cap, 0)
+        return available, day_slots, cap
+    
+    def assign_therapists_master(self, time_limit, num_workers=None):
+        """Pick one therapist per (patient, therapy type) with a slot-count relaxation; returns it and an upper bound."""
+        available, day_slots, cap = self.slot_capacities()
+        model = cp_model.CpModel()
+        choose = {}
+        therapist_load = {(k, d): [] for k in self.K for d in self.D}
+        patient_load = {(p, d): [] for p in self.P for d in self.D}
+        objective_terms = []
+        ri_weights = self.integer_weights(self.slot_length * self.E).tolist()
+        
+        for p in self.P:
+            for t in self.T:
+                candidates = [k for k in self.K if self.therapist_type[k, t] == 1 and available[k].sum() > 0]
+                if self.A[p, t] == 0 or not candidates:
+                    continue
+                for k in candidates:
+                    choose[p, t, k] = model.NewBoolVar(f'choose_p{p}_t{t}_k{k}')
+                    for d in self.D:
+                        upper = int(min(cap[p, t, d], available[k, d]))
+                        if upper == 0:
+                            continue
+                        slots = model.NewIntVar(0, upper, f'slots_p{p}_t{t}_k{k}_d{d}')
+                        model.Add(slots <= upper * choose[p, t, k])
+                        therapist_load[k, d].append(slots)
+                        patient_load[p, d].append(slots)
+                        weight = 5 if self.R[d, p, t] > 0 else 1
+                        objective_terms.append(slots * (ri_weights[k] * weight))
+                model.AddAtMostOne(choose[p, t, k] for k in candidates)
+        
+        for (k, d), load in therapist_load.items():
+            if load:
+                model.Add(sum(load) <= int(available[k, d]))
+        for load in patient_load.values():
+            if load:
+                model.Add(sum(load) <= day_slots)
+        model.Maximize(sum(objective_terms))
+        
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = time_limit
+        if num_workers:
+            solver.parameters.num_workers = num_workers
+        status = solver.Solve(model)
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            raise RuntimeError(f"Therapist assignment master model failed with status {solver.StatusName(status)}")
+        
+        assignment = np.full((self.num_patients, self.num_therapist_types), -1, dtype=int)
+        for (p, t, k), var in choose.items():
+            if solver.BooleanValue(var):
+                assignment[p, t] = k
+        return assignment, solver.BestObjectiveBound() / self.objective_scale
+    
+    def assign_therapists_heuristic(self):
+        """Pick one therapist per (patient, therapy type) by greedy demand and capacity."""
+        available, _, cap = self.slot_capacities()
+        remaining = available.sum(axis=1).astype(float)
+        demand = cap.sum(axis=2)
+        assignment = np.full((self.num_patients, self.num_therapist_types), -1, dtype=int)
+        for p, t in sorted(zip(*np.nonzero(self.A)), key=lambda pt: -demand[pt]):
+            candidates = [k for k in self.K if self.therapist_type[k, t] == 1 and remaining[k] > 0]
+            if not candidates:
+                continue
+            k = max(candidates, key=lambda k: (remaining[k], self.E[k]))
+            assignment[p, t] = k
+            remaining[k] -= demand[p, t]
+        return assignment
+    
+    def patient_clusters(self, assignment):
+        """Group patients that share an assigned therapist (connected components)."""
+        parent = list(range(self.num_patients + self.num_therapists))
+        
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        
+        for p, t in zip(*np.nonzero(assignment >= 0)):
+            parent[find(p)] = find(self.num_patients + assignment[p, t])
+        
+        clusters = {}
+        for p in self.P:
+            if (assignment[p] >= 0).any():
+                clusters.setdefault(find(p), []).append(p)
+        return list(clusters.values())
+    
+    def subproblem_rows(self, patients, day, assignment):
+        """Candidate (p, k, t, d, s) rows of one (patient cluster, day) subproblem under a fixed assignment."""
+        pairs = [(p, assignment[p, t], t) for p in patients for t in self.T if assignment[p, t] >= 0]
+        return np.array([(p, k, t, day, s) for p, k, t in pairs for s in self.S], dtype=int).reshape(-1, 5)
+    
+    def instance_data(self):
+        """The loaded instance as a dict in the input format, with numpy arrays."""
+        return {
+            "num_patients": self.num_patients,
+            "num_therapist_types": self.num_therapist_types,
+            "num_therapists": self.num_therapists,
+            "num_days": self.num_days,
+            "slots_per_day": self.slots_per_day,
+            "slot_length": self.slot_length,
+            "lunch_start": self.lunch_start,
+            "lunch_end": self.lunch_end,
+            "R": self.R,
+            "A": self.A,
+            "therapist_type": self.therapist_type,
+            "C": self.C,
+            "E": self.E
+        }
+    
+    def solve_decomposed(self, time_limit=300.0, assignment_method='master', jobs=None, continuity='linear',
+                         num_workers=None, compare_monolithic=False):
+        """Solve by fixing the therapists and then solving each (patient cluster, day) subproblem."""
+        start_time = time.time()
+        jobs = jobs or os.cpu_count() or 1
+        
+        print(f"Decomposing with {assignment_method} therapist assignment...")
+        if assignment_method == 'master':
+            assignment, master_bound = self.assign_therapists_master(time_limit * 0.2, num_workers)
+        else:
+            assignment, master_bound = self.assign_therapists_heuristic(), None
+        
+        clusters = self.patient_clusters(assignment)
+        subproblems = [(patients, d) for d in self.D for patients in clusters]
+        remaining = max(1.0, time_limit - (time.time() - start_time))
+        sub_time_limit = max(1.0, remaining * min(jobs, len(subproblems)) / max(1, len(subproblems)))
+        print(f"Solving {len(subproblems)} subproblems ({len(clusters)} patient clusters x {self.num_days} days) "
+              f"with {jobs} processes, {sub_time_limit:.1f}s each...")
+        
+        # The greedy schedule under the same assignment is feasible for every subproblem
+        hint = self.greedy_schedule(assignment)
+        
+        rows = []
+        statuses = []
+        builds = []
+        # Workers get the instance arrays once and build each subproblem from its description
+        arguments = [(patients, d, assignment, continuity, sub_time_limit,
+                      hint[np.isin(hint[:, 0], patients) & (hint[:, 3] == d)]) for patients, d in subproblems]
+        if jobs > 1 and len(subproblems) > 1:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=init_subproblem_worker,
+                                     initargs=(self.data_file, self.instance_data(),
+                                               self.objective_precision)) as executor:
+                outcomes = list(executor.map(solve_subproblem, *zip(*arguments)))
+        else:
+            outcomes = [solve_subproblem(*args, scheduler=self) for args in arguments]
+        for status, sub_rows, build in outcomes:
+            statuses.append(status)
+            rows.append(sub_rows)
+            builds.append(build)
+        build_time, num_variables, num_constraints = np.sum(builds, axis=0).tolist() if builds else (0.0, 0, 0)
+        
+        rows = np.concatenate(rows) if rows else np.zeros((0, 5), dtype=int)
+        rows = rows[np.lexsort(rows.T[::-1])] if len(rows) else rows
+        stitched = self.objective_value(rows)
+        
+        # The fixed assignment can be worse than the greedy heuristic's own choice
+        greedy = self.greedy_schedule()
+        greedy_objective = self.objective_value(greedy)
+        if greedy_objective > stitched:
+            print(f"The greedy schedule ({greedy_objective:.2f}) beats the stitched one ({stitched:.2f}); using it")
+            rows = greedy
+        objective = max(stitched, greedy_objective)
+        solve_time = time.time() - start_time
+        print(f"Decomposition completed in {solve_time:.2f} seconds, objective {objective:.2f}")
+        
+        results = self.results_from_rows(rows, self.slot_length, "FEASIBLE", solve_time)
+        decomposition = {
+            "assignment": assignment_method,
+            "num_clusters": len(clusters),
+            "num_subproblems": len(subproblems),
+            "subproblems_optimal": statuses.count("OPTIMAL"),
+            "subproblems_failed": sum(1 for status in statuses if status not in ("OPTIMAL", "FEASIBLE")),
+            "objective_value": objective,  # Of the returned schedule
+            "stitched_objective_value": stitched,
+            "greedy_objective_value": greedy_objective,
+            "schedule": "greedy" if greedy_objective > stitched else "stitched",
+            "master_bound": master_bound,
+            "gap_to_master_bound": relative_gap(objective, master_bound) if master_bound is not None else None,
+            # Subproblem models, summed over all subproblems
+            "build_time": build_time,
+            "num_variables": int(num_variables),
+            "num_constraints": int(num_constraints)
+        }
+        
+        if compare_monolithic:
+            print(f"Solving the monolithic model for comparison...")
+            model, _ = self.create_model(continuity=continuity)
+            solver = cp_model.CpSolver()
+            solver.parameters.max_time_in_seconds = time_limit
+            if num_workers:
+                solver.parameters.num_workers = num_workers
+            monolithic_start = time.time()
+            status = solver.Solve(model)
+            decomposition["monolithic"] = {
+                "status": solver.StatusName(status),
+                "solve_time": time.time() - monolithic_start,
+                "objective_value": (solver.ObjectiveValue() / self.objective_scale
+                                    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None),
+                "best_objective_bound": solver.BestObjectiveBound() / self.objective_scale,
+                "gap_to_bound": relative_gap(objective, solver.BestObjectiveBound() / self.objective_scale)
+            }
+            print(f"Monolithic {solver.StatusName(status)}: bound {decomposition['monolithic']['best_objective_bound']:.2f}, "
+                  f"the schedule is {decomposition['monolithic']['gap_to_bound']:.2%} below it")
+        
+        results["decomposition"] = decomposition
+        print(f"Total RI Minutes: {results['total_ri_minutes']}")
+        print(f"Average RI Minutes Per Patient: {results['average_ri_minutes']:.2f}")
+        return results
+    
+    def solve_rolling(self, window_days, commit_days=None, time_limit=300.0, continuity='linear',
+                      num_workers=None, relative_gap=None, absolute_gap=None):
+        """Plan the horizon in overlapping windows of `window_days` days, committing `commit_days` of each."""
+        commit_days = commit_days or max(1, window_days // 2)
+        if not 1 <= commit_days <= window_days:
+            raise ValueError(f"Commit days must be between 1 and the window length, got {commit_days}")
+        start_time = time.time()
+        data = self.instance_data()
+        therapists = {}  # (p, t) -> therapist of the committed days
+        delivered = np.zeros((self.num_patients, self.num_therapist_types), dtype=int)  # Minutes
+        committed = []
+        windows = []
+        previous = np.zeros((0, 5), dtype=int)  # Schedule of the last window, in horizon days
+        planned = 0  # Days covered by the last window
+        
+        first = 0
+        while first < self.num_days and not self.stop_requested:
+            last = min(first + window_days, self.num_days)
+            # The window that reaches the end of the horizon commits all its days
+            commit_end = self.num_days if last == self.num_days else first + commit_days
+            print(f"Window days {first + 1}-{last}, committing days {first + 1}-{commit_end}...")
+            
+            build_start = time.time()
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                window = TherapyScheduler(self.data_file, data={**data, "num_days": last - first,
+                                                                "R": self.R[first:last], "C": self.C[:, first:last]})
+            window.objective_precision = self.objective_precision
+            window.output = self.output
+            model, X = window.create_model(continuity=continuity)
+            unavailable = X.fix_therapists(model, therapists)
+            shift = np.array([0, 0, 0, first, 0])
+            hint = previous[previous[:, 3] >= first] - shift
+            known = {**{(p, t): k for p, k, t, d, s in hint.tolist()}, **therapists}
+            greedy = [row for row in window.greedy_schedule().tolist()
+                      if row[3] >= planned - first and known.get((row[0], row[2]), row[1]) == row[1]]
+            hint = np.concatenate([hint, np.array(greedy, dtype=int).reshape(-1, 5)])
+            X.add_hints(model, hint)
+            build_time = time.time() - build_start
+            if unavailable:
+                print(f"Warning: {unavailable} carried-over therapists have no available slots in this window")
+            
+            results = window.solve_model(model, X, time_limit, num_workers=num_workers, relative_gap=relative_gap,
+                                         absolute_gap=absolute_gap)
+            if results:
+                rows = window.schedule_rows(results["schedule"]) + shift
+            else:
+                # The hint satisfies every constraint, so the days are never left empty
+                print("Warning: no solution within the time limit, committing the hint schedule")
+                rows = hint + shift
+            kept = rows[rows[:, 3] < commit_end]
+            for p, k, t, d, s in kept.tolist():
+                therapists.setdefault((p, t), k)
+                delivered[p, t] += self.slot_length
+            committed.append(kept)
+            previous = rows
+            planned = last
+            
+            windows.append({
+                "first_day": first + 1,
+                "last_day": last,
+                "committed_days": commit_end - first,
+                "status": window.last_status if results else f"{window.last_status} (hint committed)",
+                "build_time": build_time,
+                "solve_time": results["solve_time"] if results else None,
+                "num_variables": len(model.Proto().variables),
+                "num_constraints": len(model.Proto().constraints),
+                "carried_therapists": len(therapists),
+                "unavailable_therapists": unavailable,
+                "committed_ri_minutes": math.fsum(self.slot_length * self.E[kept[:, 1]])
+            })
+            first = commit_end
+        
+        rows = np.concatenate(committed) if committed else np.zeros((0, 5), dtype=int)
+        solve_time = time.time() - start_time
+        print(f"Rolling horizon completed in {solve_time:.2f} seconds with {len(windows)} windows")
+        results = self.results_from_rows(rows, self.slot_length, "FEASIBLE", solve_time)
+        results["rolling"] = {
+            "window_days": window_days,
+            "commit_days": commit_days,
+            "windows": windows,
+            "delivered": [{"Patient": p + 1, "Therapy Type": t + 1, "Therapist": therapists[p, t] + 1,
+                           "Delivered Minutes": int(delivered[p, t]), "Required Minutes": int(self.R[:, p, t].sum())}
+                          for p, t in sorted(therapists)]
+        }
+        print(f"Total RI Minutes: {results['total_ri_minutes']}")
+        print(f"Average RI Minutes Per Patient: {results['average_ri_minutes']:.2f}")
+        return results
+    
+    def add_candidates(self, candidates):
+        """Append candidate therapists to the instance and return their 0-based indices."""
+        first = self.num_therapists
+        for candidate in candidates:
+            therapist_type = np.zeros((1, self.num_therapist_types), dtype=bool)
+            therapist_type[0, candidate["therapist_type"] - 1] = True
+            availability = np.asarray(candidate.get("C", np.ones((self.num_days, self.slots_per_day))), dtype=bool)
+            self.therapist_type = np.vstack([self.therapist_type, therapist_type])
+            self.C = np.concatenate([self.C, availability[None, :, :]])
+            self.E = np.append(self.E, candidate.get("E", float(self.E[:first].mean())))
+        self.num_therapists += len(candidates)
+        self.K = range(self.num_therapists)
+        return {candidate["name"]: first + i for i, candidate in enumerate(candidates)}
+    
+    def scenario_availability(self, scenario, candidates, base_C):
+        """Active therapists [therapist] and availability [therapist, day, slot] of a scenario."""
+        def therapist(value):
+            return candidates[value] if isinstance(value, str) else value - 1
+        
+        active = np.arange(self.num_therapists) < self.num_therapists - len(candidates)
+        active[[candidates[name] for name in scenario.get("add", [])]] = True
+        active[[therapist(value) for value in scenario.get("remove", [])]] = False
+        C = base_C.copy()
+        for value, windows in ((0, scenario.get("unavailable", [])), (1, scenario.get("available", []))):
+            for window in windows:
+                first, last = window.get("slots", [1, self.slots_per_day])
+                C[therapist(window["therapist"]), window["day"] - 1, first - 1:last] = value
+        return active, C
+    
+    def sweep_staffing(self, scenarios, time_limit=60.0, continuity='linear', num_workers=None, jobs=None):
+        """Solve staffing what-if scenarios on one model and tabulate their RI minutes."""
+        start_time = time.time()
+        greedy_rows = self.greedy_schedule()
+        candidates = self.add_candidates(scenarios.get("candidates", []))
+        scenario_list = [{"name": "baseline"}] + [s for s in scenarios.get("scenarios", []) if s.get("name") != "baseline"]
+        names = {scenario["name"] for scenario in scenario_list}
+        scenario_list += [{"name": f"+{name}", "add": [name]} for name in candidates if f"+{name}" not in names]
+        
+        base_C = self.C.copy()
+        settings = [self.scenario_availability(scenario, candidates, base_C) for scenario in scenario_list]
+        # Build with the union of all scenarios' availability so no scenario needs a rebuild
+        self.C = np.maximum.reduce([C for _, C in settings])
+        model, X = self.create_model(continuity=continuity)
+        self.C = base_C
+        print(f"Built one model with {len(X)} assignment variables for {len(scenario_list)} scenarios "
+              f"in {time.time() - start_time:.2f} seconds")
+        
+        var_indices = X.var_indices.tolist()
+        p, k, t, d, s = X.index.T
+        
+        def solve(active, C, hint_rows):
+            off = ~active[k] | (C[k, d, s] == 0)
+            scenario_model = model.Clone()
+            proto = scenario_model.Proto()
+            for position in np.flatnonzero(off).tolist():
+                domain = proto.variables[var_indices[position]].domain
+                domain[0] = domain[1] = 0
+            hk, hd, hs = hint_rows[:, 1], hint_rows[:, 3], hint_rows[:, 4]
+            X.add_hints(scenario_model, hint_rows[active[hk] & (C[hk, hd, hs] == 1)])
+            solver = cp_model.CpSolver()
+            solver.parameters.max_time_in_seconds = time_limit
+            if num_workers:
+                solver.parameters.num_workers = num_workers
+            status = solver.Solve(scenario_model)
+            rows = X.active(solver) if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None
+            return solver.StatusName(status), rows, solver.WallTime()
+        
+        print("Solving the baseline...")
+        outcomes = [solve(*settings[0], greedy_rows)]
+        baseline_rows = outcomes[0][1] if outcomes[0][1] is not None else greedy_rows
+        
+        jobs, num_workers = split_cores(len(scenario_list) - 1, jobs, num_workers)
+        print(f"Solving {len(scenario_list) - 1} scenarios with {jobs} parallel solves and {num_workers} workers each...")
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            outcomes += executor.map(lambda setting: solve(*setting, baseline_rows), settings[1:])
+        
+        table = []
+        for scenario, (active, _), (status, rows, wall_time) in zip(scenario_list, settings, outcomes):
+            total = float(np.sum(self.slot_length * self.E[rows[:, 1]])) if rows is not None else None
+            table.append({
+                "scenario": scenario["name"],
+                "status": status,
+                "therapists": int(active.sum()),
+                "total_ri_minutes": total,
+                "average_ri_minutes": total / self.num_patients if total is not None else None,
+                "solve_time": wall_time
+            })
+        
+        sweep = pd.DataFrame(table)
+        baseline = sweep.loc[0]
+        sweep["ri_minutes_change"] = sweep["total_ri_minutes"] - baseline["total_ri_minutes"]
+        sweep["staff_change"] = sweep["therapists"] - baseline["therapists"]
+        # Marginal RI minutes per therapist added (or removed) relative to the baseline
+        sweep["marginal_ri_minutes"] = (sweep["ri_minutes_change"] / sweep["staff_change"].where(sweep["staff_change"] != 0))
+        print(f"Sweep completed in {time.time() - start_time:.2f} seconds")
+        return sweep
+    
+    def save_sweep(self, sweep, output_file):
+        """Save a staffing sweep table as CSV and a markdown summary next to it."""
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        sweep.to_csv(output_file, index=False)
+        print(f"Sweep results saved to {output_file}")
+        
+        markdown_output = os.path.splitext(output_file)[0] + "_summary.md"
+        with open(markdown_output, 'w') as md_file:
+            md_file.write(f"# Staffing Scenario Sweep\n\n")
+            md_file.write(f"- **Input Dataset**: {self.data_file}\n")
+            md_file.write(f"- **Scenarios**: {len(sweep)}\n\n")
+            md_file.write("| Scenario | Status | Therapists | Total RI Minutes | Average RI Minutes | Change | Marginal RI Minutes Per Therapist |\n")
+            md_file.write("|----------|--------|------------|------------------|--------------------|--------|-----------------------------------|\n")
+            columns = ["scenario", "status", "therapists", "total_ri_minutes", "average_ri_minutes",
+                       "ri_minutes_change", "marginal_ri_minutes"]
+            for row in sweep[columns].itertuples(index=False):
+                values = ["-" if pd.isna(value) else f"{value:.2f}" if isinstance(value, float) else str(value)
+                          for value in row]
+                md_file.write("| " + " | ".join(values) + " |\n")
+        print(f"Markdown summary saved to {markdown_output}")
+    
+    def format_time(self, slot, unit_length=None):
         """Convert slot number to time string (assuming 8:00 AM start)."""
         start_time = datetime(2023, 1, 1, 8, 0, 0)  # Arbitrary date with 8:00 AM
-        minutes_to_add = slot * self.slot_length
+        minutes_to_add = slot * (unit_length or self.slot_length)
         time_value = start_time + timedelta(minutes=minutes_to_add)
         return time_value.strftime("%H:%M")
     
+    def schedule_frame(self, results):
+        """Schedule as a DataFrame sorted by day, patient and slot, with a display line per row."""
+        schedule_df = pd.DataFrame(results["schedule"], columns=SCHEDULE_COLUMNS)
+        schedule_df = schedule_df.sort_values(by=["Day", "Patient", "Slot"], kind="stable")
+        therapy_type = np.where(schedule_df["Therapy Type"] == 1, "OT",
+                                np.where(schedule_df["Therapy Type"] == 2, "PT", "SLP"))
+        schedule_df["Line"] = (schedule_df["Time"] + " - " + therapy_type + " with Therapist "
+                               + schedule_df["Therapist"].astype(str))
+        return schedule_df
+    
+    def schedule_blocks(self, schedule_df):
+        """Yield (day, patient, lines) per patient-day in one groupby pass."""
+        for (day, patient), lines in schedule_df.groupby(["Day", "Patient"], sort=True)["Line"]:
+            yield day, patient, lines.tolist()
+    
+    def print_profile(self, profile):
+        """Print the phases, constraint families and presolve reduction of a PhaseProfile report."""
+        print("\nProfile:")
+        for phase in profile["phases"]:
+            print(f"  {phase['name']:<24} {phase['time']:8.2f} s {phase['peak_memory_mb']:9.1f} MB peak")
+        for family in profile["families"]:
+            print(f"  {family['name']:<24} {family['time']:8.2f} s {family['peak_memory_mb']:9.1f} MB peak "
+                  f"{family['num_variables']:>9} variables {family['num_constraints']:>9} constraints")
+        presolve = profile["presolve"]
+        if presolve and presolve["before"] and presolve["after"]:
+            print(f"  presolve: {presolve['before']['variables']} -> {presolve['after']['variables']} variables, "
+                  f"{presolve['before']['constraints']} -> {presolve['after']['constraints']} constraints")
+    
     def print_schedule(self, results):
         """Print the schedule in a readable format."""
         if not results or "schedule" not in results:
             print("No schedule to print.")
             return
         
-        schedule_df = pd.DataFrame(results["schedule"])
-        
         # Sort by day, patient, time
-        schedule_df = schedule_df.sort_values(by=["Day", "Patient", "Slot"])
+        schedule_df = self.schedule_frame(results)
         
         # Print summary
         print("\nSchedule Summary:")
@@ -313,20 +1904,16 @@ class TherapyScheduler:
         
         # Print schedule by day
         print("\nDetailed Schedule:")
-        for day in sorted(schedule_df["Day"].unique()):
-            print(f"\nDay {day}:")
-            
-            day_schedule = schedule_df[schedule_df["Day"] == day]
-            for patient in sorted(day_schedule["Patient"].unique()):
-                patient_schedule = day_schedule[day_schedule["Patient"] == patient]
-                print(f"\n  Patient {patient}:")
-                
-                for _, row in patient_schedule.iterrows():
-                    therapy_type = "OT" if row["Therapy Type"] == 1 else "PT" if row["Therapy Type"] == 2 else "SLP"
-                    print(f"    {row['Time']} - {therapy_type} with Therapist {row['Therapist']}")
+        current_day = None
+        for day, patient, lines in self.schedule_blocks(schedule_df):
+            if day != current_day:
+                print(f"\nDay {day}:")
+                current_day = day
+            print(f"\n  Patient {patient}:")
+            print("\n".join(f"    {line}" for line in lines))
     
-    def save_results(self, results, output_file):
-        """Save results to a JSON file and create a folder structure."""
+    def save_results(self, results, output_file, formats=('json',)):
+        """Save results in the given `formats` and a markdown summary, creating the folder structure."""
         if not results:
             print("No results to save.")
             return
@@ -336,12 +1923,32 @@ class TherapyScheduler:
         os.makedirs(results_dir, exist_ok=True)
         
         # Save JSON results
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
-        print(f"Results saved to {output_file}")
+        if 'json' in formats:
+            with open(output_file, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results saved to {output_file}")
+        
+        # Save the schedule in columnar formats
+        schedule_df = self.schedule_frame(results)
+        table_base = os.path.splitext(output_file)[0]
+        if 'csv' in formats:
+            schedule_df[SCHEDULE_COLUMNS].to_csv(table_base + ".csv", index=False)
+            print(f"Schedule saved to {table_base}.csv")
+        if 'parquet' in formats:
+            try:
+                schedule_df[SCHEDULE_COLUMNS].to_parquet(table_base + ".parquet", index=False)
+                print(f"Schedule saved to {table_base}.parquet")
+            except ImportError:
+                print("Parquet output requires pyarrow or fastparquet; skipping.")
+        if 'npz' in formats:
+            np.savez_compressed(
+                table_base + ".npz",
+                **{column.lower().replace(" ", "_"): schedule_df[column].to_numpy(dtype=str if column == "Time" else None)
+                   for column in SCHEDULE_COLUMNS},
+                total_ri_minutes=results["total_ri_minutes"], status=results["status"])
+            print(f"Schedule saved to {table_base}.npz")
         
         # Create summary markdown file
-        schedule_df = pd.DataFrame(results["schedule"])
         markdown_output = os.path.join(results_dir, os.path.splitext(os.path.basename(output_file))[0] + "_summary.md")
         
         with open(markdown_output, 'w') as md_file:
@@ -363,69 +1970,828 @@ class TherapyScheduler:
             md_file.write(f"- **Slots Per Day**: {self.slots_per_day}\n")
             md_file.write(f"- **Slot Length**: {self.slot_length} minutes\n\n")
             
-            md_file.write(f"## Schedule Details\n\n")
+            # Add solver telemetry
+            telemetry = results.get("telemetry")
+            if telemetry:
+                md_file.write(f"## Solver Telemetry\n\n")
+                md_file.write(f"- **Variables**: {telemetry['num_variables']}\n")
+                md_file.write(f"- **Constraints**: {telemetry['num_constraints']}\n")
+                if telemetry['presolve_time'] is not None:
+                    md_file.write(f"- **Presolve Time**: {telemetry['presolve_time']:.2f} seconds\n")
+                md_file.write(f"- **Branches**: {telemetry['num_branches']}\n")
+                md_file.write(f"- **Conflicts**: {telemetry['num_conflicts']}\n")
+                md_file.write(f"- **Objective / Best Bound**: {telemetry['objective_value']:.2f} / "
+                              f"{telemetry['best_objective_bound']:.2f} (gap {telemetry['gap']:.2%})\n\n")
+            
+            # Add the profile of --profile runs
+            profile = results.get("profile")
+            if profile:
+                md_file.write(f"## Profile\n\n")
+                md_file.write("| Phase | Time (s) | Peak Memory (MB) |\n")
+                md_file.write("|-------|----------|------------------|\n")
+                for phase in profile["phases"]:
+                    md_file.write(f"| {phase['name']} | {phase['time']:.2f} | {phase['peak_memory_mb']:.1f} |\n")
+                md_file.write("\n")
+                if profile["families"]:
+                    md_file.write("| Constraint Family | Time (s) | Variables | Constraints | Peak Memory (MB) |\n")
+                    md_file.write("|-------------------|----------|-----------|-------------|------------------|\n")
+                    for family in profile["families"]:
+                        md_file.write(f"| {family['name']} | {family['time']:.2f} | {family['num_variables']} | "
+                                      f"{family['num_constraints']} | {family['peak_memory_mb']:.1f} |\n")
+                    md_file.write("\n")
+                presolve = profile["presolve"]
+                if presolve and presolve["before"] and presolve["after"]:
+                    md_file.write(f"- **Presolve**: {presolve['before']['variables']} -> "
+                                  f"{presolve['after']['variables']} variables, {presolve['before']['constraints']} -> "
+                                  f"{presolve['after']['constraints']} constraints")
+                    if presolve["presolve_time"] is not None:
+                        md_file.write(f" in {presolve['presolve_time']:.2f} seconds")
+                    md_file.write("\n")
+                    for rule, count in sorted(presolve["rules"].items(), key=lambda item: -item[1])[:10]:
+                        md_file.write(f"- `{rule}`: {count}\n")
+                    md_file.write("\n")
+            
+            # Add decomposition quality
+            decomposition = results.get("decomposition")
+            if decomposition:
+                md_file.write(f"## Decomposition\n\n")
+                md_file.write(f"- **Therapist Assignment**: {decomposition['assignment']}\n")
+                md_file.write(f"- **Subproblems**: {decomposition['num_subproblems']} "
+                              f"({decomposition['num_clusters']} patient clusters, "
+                              f"{decomposition['subproblems_optimal']} solved to optimality)\n")
+                md_file.write(f"- **Stitched Objective**: {decomposition['stitched_objective_value']:.2f}\n")
+                md_file.write(f"- **Greedy Objective**: {decomposition['greedy_objective_value']:.2f} "
+                              f"(the {decomposition['schedule']} schedule is returned)\n")
+                if decomposition['master_bound'] is not None:
+                    md_file.write(f"- **Master Bound**: {decomposition['master_bound']:.2f} "
+                                  f"(gap {decomposition['gap_to_master_bound']:.2%})\n")
+                monolithic = decomposition.get("monolithic")
+                if monolithic:
+                    md_file.write(f"- **Monolithic Bound**: {monolithic['best_objective_bound']:.2f} "
+                                  f"(gap {monolithic['gap_to_bound']:.2%}, {monolithic['status']} "
+                                  f"in {monolithic['solve_time']:.2f} seconds)\n")
+                md_file.write("\n")
             
-            # Sort by day, patient, time
-            schedule_df = schedule_df.sort_values(by=["Day", "Patient", "Slot"])
+            # Add rolling-horizon windows
+            rolling = results.get("rolling")
+            if rolling:
+                md_file.write(f"## Rolling Horizon\n\n")
+                md_file.write(f"- **Window**: {rolling['window_days']} days, committing {rolling['commit_days']}\n")
+                md_file.write(f"- **Windows**: {len(rolling['windows'])}\n\n")
+                md_file.write("| Days | Committed | Status | Variables | Build Time (s) | Solve Time (s) | Committed RI Minutes |\n")
+                md_file.write("|------|-----------|--------|-----------|----------------|----------------|----------------------|\n")
+                for window in rolling["windows"]:
+                    solve_time = f"{window['solve_time']:.2f}" if window['solve_time'] is not None else "-"
+                    md_file.write(f"| {window['first_day']}-{window['last_day']} | {window['committed_days']} | "
+                                  f"{window['status']} | {window['num_variables']} | {window['build_time']:.2f} | "
+                                  f"{solve_time} | {window['committed_ri_minutes']:.2f} |\n")
+                md_file.write("\n")
+            
+            # Add lexicographic phases
+            lexicographic = results.get("lexicographic")
+            if lexicographic:
+                md_file.write(f"## Lexicographic Optimization\n\n")
+                md_file.write(f"- **Phase 1 Coverage**: {lexicographic['covered_minutes']} of "
+                              f"{lexicographic['required_minutes']} required minutes "
+                              f"({lexicographic['phase1_status']} in {lexicographic['phase1_time']:.2f} seconds)\n")
+                md_file.write(f"- **Phase 2**: RI minutes maximized with coverage fixed\n\n")
+            
+            # Add symmetry breaking statistics
+            symmetry = results.get("symmetry")
+            if symmetry:
+                md_file.write(f"## Symmetry Breaking\n\n")
+                md_file.write(f"- **Therapist Classes**: {len(symmetry['therapist_classes'])} "
+                              f"{symmetry['therapist_classes']}\n")
+                md_file.write(f"- **Constraints Added**: {symmetry['num_constraints']}\n")
+                md_file.write(f"- **Equivalent Schedules Removed**: up to 10^{symmetry['log10_symmetric_copies']:.1f}\n\n")
+            
+            # Add comparison with the previous schedule
+            changes = results.get("changes")
+            if changes:
+                md_file.write(f"## Changes From Previous Schedule\n\n")
+                md_file.write(f"- **Sessions Changed**: {changes['sessions_changed']} of {changes['sessions_total']}\n")
+                md_file.write(f"- **Slots Kept / Added / Removed**: {changes['slots_kept']} / "
+                              f"{changes['slots_added']} / {changes['slots_removed']}\n\n")
+            
+            md_file.write(f"## Schedule Details\n\n")
             
             # Group by therapy type to get statistics
-            therapy_counts = schedule_df["Therapy Type"].value_counts()
-            therapy_minutes = schedule_df.groupby("Therapy Type")["RI Minutes"].sum()
+            therapy_stats = schedule_df.groupby("Therapy Type")["RI Minutes"].agg(["count", "sum"])
             
             md_file.write("### Therapy Type Statistics\n\n")
             md_file.write("| Therapy Type | Sessions | Total Minutes |\n")
             md_file.write("|-------------|----------|---------------|\n")
-            for t_type in sorted(therapy_counts.index):
+            for t_type, sessions, minutes in therapy_stats.itertuples():
                 therapy_name = "OT" if t_type == 1 else "PT" if t_type == 2 else "SLP"
-                md_file.write(f"| {therapy_name} | {therapy_counts[t_type]} | {therapy_minutes[t_type]:.2f} |\n")
+                md_file.write(f"| {therapy_name} | {sessions} | {minutes:.2f} |\n")
             
             md_file.write("\n### Detailed Daily Schedule\n\n")
             
-            for day in sorted(schedule_df["Day"].unique()):
-                md_file.write(f"#### Day {day}\n\n")
-                
-                day_schedule = schedule_df[schedule_df["Day"] == day]
-                for patient in sorted(day_schedule["Patient"].unique()):
-                    md_file.write(f"**Patient {patient}**\n\n")
-                    
-                    patient_schedule = day_schedule[day_schedule["Patient"] == patient]
-                    for _, row in patient_schedule.iterrows():
-                        therapy_type = "OT" if row["Therapy Type"] == 1 else "PT" if row["Therapy Type"] == 2 else "SLP"
-                        md_file.write(f"- {row['Time']} - {therapy_type} with Therapist {row['Therapist']}\n")
-                    
-                    md_file.write("\n")
-                
+            current_day = None
+            for day, patient, lines in self.schedule_blocks(schedule_df):
+                if day != current_day:
+                    if current_day is not None:
+                        md_file.write("\n")
+                    md_file.write(f"#### Day {day}\n\n")
+                    current_day = day
+                md_file.write(f"**Patient {patient}**\n\n")
+                md_file.write("".join(f"- {line}\n" for line in lines))
+                md_file.write("\n")
+            if current_day is not None:
                 md_file.write("\n")
             
         print(f"Markdown summary saved to {markdown_output}")
     
-    def run(self, time_limit=300.0, output_file=None):
-        """Run the optimization and return results."""
-        model, X = self.create_model()
-        results = self.solve_model(model, X, time_limit)
+    def run(self, time_limit=300.0, output_file=None, formats=('json',), **options):
+        """Run the optimization, print and save the results, and return them."""
+        return self.report_results(self.solve(time_limit, **options), output_file, formats)
+    
+    def solve(self, time_limit=300.0, continuity='linear', backend='slots', resolution=None,
+              num_workers=None, relative_gap=None, absolute_gap=None, incumbent_file=None,
+              hint_from=None, freeze_before=None, decompose=None, jobs=None, compare_monolithic=False,
+              engine='cpsat', greedy_hint=None, seed=0, symmetry=False, lexicographic=False,
+              objective_precision=2, window_days=None, commit_days=None):
+        """Solve with the given options and return the results without saving them."""
+        check_solve_options(backend=backend, resolution=resolution, incumbent_file=incumbent_file,
+                            hint_from=hint_from, freeze_before=freeze_before, decompose=decompose,
+                            compare_monolithic=compare_monolithic, engine=engine, greedy_hint=greedy_hint,
+                            symmetry=symmetry, lexicographic=lexicographic, window_days=window_days,
+                            commit_days=commit_days)
+        self.objective_precision = objective_precision
+        if engine == 'greedy':
+            return self.solve_greedy()
+        if engine == 'lns':
+            return self.solve_lns(time_limit, continuity=continuity, num_workers=num_workers, seed=seed)
+        if window_days:
+            return self.solve_rolling(window_days, commit_days, time_limit, continuity=continuity,
+                                      num_workers=num_workers, relative_gap=relative_gap, absolute_gap=absolute_gap)
+        if decompose:
+            return self.solve_decomposed(time_limit, assignment_method=decompose, jobs=jobs,
+                                         continuity=continuity, num_workers=num_workers,
+                                         compare_monolithic=compare_monolithic)
+        
+        with self.profile_phase('build'):
+            if backend == 'intervals':
+                model, X = self.create_interval_model(resolution=resolution, symmetry=symmetry)
+            else:
+                model, X = self.create_model(continuity=continuity, symmetry=symmetry)
+        if symmetry:
+            stats = self.symmetry_stats
+            print(f"Symmetry breaking: {len(stats['therapist_classes'])} therapist classes, "
+                  f"{stats['num_constraints']} constraints, "
+                  f"up to 10^{stats['log10_symmetric_copies']:.1f} equivalent schedules removed")
+        previous = None
+        if hint_from:
+            previous = self.load_schedule(hint_from, X.unit_length)
+            X.add_hints(model, previous)
+            print(f"Loaded {len(previous)} scheduled slots from {hint_from} as solution hints")
+            if freeze_before:
+                dropped = X.freeze(model, previous, freeze_before)
+                print(f"Pinned previous sessions before day {freeze_before[0] + 1}, slot {freeze_before[1] + 1}")
+                if dropped:
+                    print(f"Warning: {dropped} previous sessions before the freeze point are no longer feasible")
+        elif greedy_hint is not False:
+            # On by default: the continuity encoding proves the optimum of the sample
+            # in about 1 second from this hint instead of about 20 without it.
+            # Hints must satisfy the symmetry-breaking constraints
+            # The greedy schedule is in slots; the intervals backend may use finer units
+            greedy = self.convert_units(np.asarray(self.greedy_schedule(), dtype=int).reshape(-1, 5),
+                                        self.slot_length, X.unit_length)
+            X.add_hints(model, self.canonical_rows(greedy) if symmetry else greedy)
+            print("Using the greedy schedule as solution hint")
         
+        solve = self.solve_lexicographic if lexicographic else self.solve_model
+        with self.profile_phase('solve'):
+            results = solve(model, X, time_limit, num_workers=num_workers, relative_gap=relative_gap,
+                            absolute_gap=absolute_gap, incumbent_file=incumbent_file)
+        if results and symmetry:
+            results["symmetry"] = self.symmetry_stats
+        if self.profile:
+            # Printed even without a solution, when a slow build or presolve matters most
+            profile = self.profile.report()
+            self.print_profile(profile)
+            if results:
+                results["profile"] = profile
+        
+        if results and previous is not None:
+            changes = self.compare_schedules(previous, self.schedule_rows(results["schedule"]))
+            results["changes"] = changes
+            print(f"Changes from previous schedule: {changes['sessions_changed']} of {changes['sessions_total']} "
+                  f"sessions, {changes['slots_added']} slots added, {changes['slots_removed']} removed")
+        
+        return results
+    
+    def report_results(self, results, output_file=None, formats=('json',)):
+        """Print the schedule and save it to `output_file` (default: results/schedule_<input>.json)."""
         if results:
             self.print_schedule(results)
             
             if output_file:
-                self.save_results(results, output_file)
+                self.save_results(results, output_file, formats)
             else:
                 # Default output file if none specified
                 results_dir = "results"
                 os.makedirs(results_dir, exist_ok=True)
                 file_basename = os.path.splitext(os.path.basename(self.data_file))[0]
                 output_file = os.path.join(results_dir, f"schedule_{file_basename}.json")
-                self.save_results(results, output_file)
+                self.save_results(results, output_file, formats)
         
         return results
 
+def parse_freeze_point(value):
+    """Parse a 1-based 'DAY/SLOT' (or 'DAY') freeze point into a 0-based (day, slot) tuple."""
+    try:
+        parts = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid freeze point '{value}', expected DAY/SLOT")
+    if len(parts) == 1:
+        parts.append(1)
+    if len(parts) != 2 or min(parts) < 1:
+        raise argparse.ArgumentTypeError(f"Invalid freeze point '{value}', expected DAY/SLOT")
+    return (parts[0] - 1, parts[1] - 1)
+
+def check_solve_options(backend='slots', resolution=None, incumbent_file=None, hint_from=None, freeze_before=None,
+                        decompose=None, compare_monolithic=False, engine='cpsat', greedy_hint=None, symmetry=False,
+                        lexicographic=False, window_days=None, commit_days=None, **options):
+    """Raise ValueError for options of TherapyScheduler.solve that cannot be combined."""
+    if freeze_before and not hint_from:
+        raise ValueError("freeze_before requires hint_from")
+    if greedy_hint and hint_from:
+        raise ValueError("greedy_hint and hint_from are mutually exclusive")
+    if resolution and backend != 'intervals':
+        raise ValueError("resolution requires the intervals backend")
+    if compare_monolithic and not decompose:
+        raise ValueError("compare_monolithic requires decompose")
+    if commit_days and not window_days:
+        raise ValueError("commit_days requires window_days")
+    if window_days is not None and (window_days < 1 or not 1 <= (commit_days or 1) <= window_days):
+        raise ValueError("window_days must be positive and commit_days between 1 and window_days")
+    if engine != 'cpsat' and (backend != 'slots' or incumbent_file or hint_from or decompose or greedy_hint
+                              or symmetry or lexicographic or window_days):
+        raise ValueError(f"engine {engine} works with the slots backend, without incumbent_file, hint_from, "
+                         f"decompose, greedy_hint, symmetry, lexicographic or window_days")
+    if decompose and (backend != 'slots' or incumbent_file or hint_from or greedy_hint or symmetry
+                      or lexicographic or window_days):
+        raise ValueError("decompose works with the slots backend, without incumbent_file, hint_from, greedy_hint, "
+                         "symmetry, lexicographic or window_days")
+    if window_days and (backend != 'slots' or incumbent_file or hint_from or greedy_hint or symmetry or lexicographic):
+        raise ValueError("window_days works with the slots backend, without incumbent_file, hint_from, greedy_hint, "
+                         "symmetry or lexicographic")
+    if lexicographic and backend != 'slots':
+        raise ValueError("lexicographic requires the slots backend")
+    if symmetry and hint_from:
+        # The relabelled hint would move sessions between patients and therapists
+        raise ValueError("symmetry cannot be combined with hint_from")
+
+def batch_jobs(spec, options):
+    """List the jobs of a batch given as a directory, a glob or a JSON manifest of {data_file, name, options} entries."""
+    entries = None
+    if os.path.isdir(spec):
+        entries = [{"data_file": path} for path in sorted(glob.glob(os.path.join(spec, "*.json")))]
+    elif os.path.isfile(spec):
+        with open(spec, 'r') as f:
+            manifest = json.load(f)
+        if not isinstance(manifest, list):
+            # A single instance file
+            manifest = [{"data_file": os.path.basename(spec)}]
+        base_dir = os.path.dirname(spec)
+        entries = [{**entry, "data_file": os.path.join(base_dir, entry["data_file"])} for entry in manifest]
+    else:
+        entries = [{"data_file": path} for path in sorted(glob.glob(spec))]
+    
+    jobs = []
+    names = set()
+    for entry in entries:
+        name = entry.get("name") or os.path.splitext(os.path.basename(entry["data_file"]))[0]
+        unique_name, suffix = name, 2
+        while unique_name in names:
+            unique_name, suffix = f"{name}_{suffix}", suffix + 1
+        names.add(unique_name)
+        jobs.append({"name": unique_name, "data_file": entry["data_file"],
+                     "options": {**options, **entry.get("options", {})}})
+    return jobs
+
+def split_cores(num_jobs, jobs=None, num_workers=None):
+    """Split the CPU cores between parallel batch jobs and CP-SAT workers per job, preferring more jobs."""
+    cores = os.cpu_count() or 1
+    if not jobs:
+        jobs = cores // num_workers if num_workers else cores
+    jobs = max(1, min(jobs, num_jobs))
+    num_workers = num_workers or max(1, cores // jobs)
+    return jobs, num_workers
+
+def run_batch_job(job, output_dir, formats, num_workers, model_cache=None):
+    """Solve one batch job in a worker process, logging to a file; returns a summary row and never raises."""
+    output_file = os.path.join(output_dir, f"schedule_{job['name']}.json")
+    summary = {"name": job["name"], "data_file": job["data_file"], "status": "ERROR",
+               "total_ri_minutes": None, "average_ri_minutes": None, "solve_time": None,
+               "wall_time": None, "output_file": None, "error": None}
+    start_time = time.time()
+    with open(os.path.join(output_dir, f"schedule_{job['name']}.log"), 'w') as log, redirect_stdout(log):
+        try:
+            options = dict(job["options"])
+            if isinstance(options.get("freeze_before"), str):
+                options["freeze_before"] = parse_freeze_point(options["freeze_before"])
+            options.setdefault("num_workers", num_workers)
+            # Decomposition subproblems share the cores of this job
+            options.setdefault("jobs", num_workers)
+            scheduler = TherapyScheduler(job["data_file"])
+            scheduler.model_cache = model_cache
+            results = scheduler.run(output_file=output_file, formats=formats, **options)
+            if results:
+                summary.update(status=results["status"], total_ri_minutes=results["total_ri_minutes"],
+                               average_ri_minutes=results["average_ri_minutes"],
+                               solve_time=results["solve_time"], output_file=output_file)
+            else:
+                summary["status"] = scheduler.last_status or "NO_SOLUTION"
+        except Exception as error:
+            summary["error"] = f"{type(error).__name__}: {error}"
+            traceback.print_exc(file=log)
+    summary["wall_time"] = time.time() - start_time
+    return summary
+
+def run_batch(jobs, output_dir, parallel_jobs=None, num_workers=None, formats=('json',), model_cache=None):
+    """Solve batch jobs in a process pool and write a combined summary table."""
+    os.makedirs(output_dir, exist_ok=True)
+    parallel_jobs, num_workers = split_cores(len(jobs), parallel_jobs, num_workers)
+    print(f"Solving {len(jobs)} instances with {parallel_jobs} parallel jobs and "
+          f"{num_workers} CP-SAT workers each...")
+    
+    summaries = {}
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=parallel_jobs) as executor:
+        futures = {executor.submit(run_batch_job, job, output_dir, formats, num_workers, model_cache): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                summary = future.result()
+            except Exception as error:
+                # The worker process itself died, e.g. killed for running out of memory
+                summary = {"name": job["name"], "data_file": job["data_file"], "status": "ERROR",
+                           "error": f"{type(error).__name__}: {error}"}
+            summaries[job["name"]] = summary
+            minutes = summary.get("total_ri_minutes")
+            print(f"  {job['name']}: {summary['status']}"
+                  + (f", {minutes:.2f} RI minutes" if minutes is not None else "")
+                  + (f" ({summary['error']})" if summary.get("error") else ""))
+    
+    summary_df = pd.DataFrame([summaries[job["name"]] for job in jobs])
+    summary_file = os.path.join(output_dir, "batch_summary.csv")
+    summary_df.to_csv(summary_file, index=False)
+    
+    columns = ["name", "status", "total_ri_minutes", "average_ri_minutes", "solve_time", "wall_time"]
+    with open(os.path.join(output_dir, "batch_summary.md"), 'w') as md_file:
+        md_file.write(f"# Therapy Schedule Batch Results\n\n")
+        md_file.write(f"- **Instances**: {len(jobs)}\n")
+        md_file.write(f"- **Solved**: {int(summary_df['total_ri_minutes'].notna().sum())}\n")
+        md_file.write(f"- **Parallel Jobs**: {parallel_jobs}\n")
+        md_file.write(f"- **CP-SAT Workers Per Job**: {num_workers}\n")
+        md_file.write(f"- **Total Time**: {time.time() - start_time:.2f} seconds\n\n")
+        md_file.write("| Instance | Status | Total RI Minutes | Average RI Minutes | Solve Time (s) | Wall Time (s) |\n")
+        md_file.write("|----------|--------|------------------|--------------------|----------------|---------------|\n")
+        for row in summary_df.reindex(columns=columns).itertuples(index=False):
+            values = ["-" if pd.isna(value) else f"{value:.2f}" if isinstance(value, float) else str(value)
+                      for value in row]
+            md_file.write("| " + " | ".join(values) + " |\n")
+    
+    print()
+    print(summary_df.reindex(columns=columns).to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+    print(f"\nBatch summary saved to {summary_file}")
+    return summary_df
+
+class MemoryModelCache(ModelCache):
+    """In-memory ModelCache for the scheduling service that returns a fresh clone on every load."""
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+    
+    def load(self, key, index_class):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        model, index_data, extra = entry
+        model = model.Clone()
+        return model, index_class.from_cache(model, index_data), extra
+    
+    def store(self, key, model, X, extra=None):
+        with self.lock:
+            self.entries[key] = (model.Clone(), X.to_cache(), extra)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class JobOutput(io.TextIOBase):
+    """Replacement for sys.stdout that sends each service worker thread's prints to its job log."""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+    
+    def write(self, text):
+        log = getattr(self.local, 'log', None)
+        if log is None:
+            return self.stream.write(text)
+        return log.write(text)
+    
+    def flush(self):
+        self.stream.flush()
+
+# Keyword arguments of TherapyScheduler.solve that service requests may set. Options
+# naming files (incumbent_file, hint_from) or starting processes (decompose, jobs)
+# are left out, as is num_workers, which the service divides between its jobs.
+SERVICE_OPTIONS = {"time_limit", "continuity", "backend", "resolution", "relative_gap", "absolute_gap",
+                   "engine", "greedy_hint", "seed", "symmetry", "lexicographic", "objective_precision"}
+
+class SchedulingService:
+    """Job queue, worker threads and instance/model caches behind the `serve` mode."""
+    
+    def __init__(self, pool_size=1, queue_size=100, num_workers=None, time_limit=60.0, cache_entries=32,
+                 history=1000):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.num_workers = num_workers
+        self.time_limit = time_limit
+        self.cache_entries = cache_entries
+        self.history = history
+        self.jobs = OrderedDict()
+        self.instances = OrderedDict()
+        self.model_cache = MemoryModelCache(cache_entries)
+        self.lock = threading.Lock()
+        # Seconds from submission to start and to completion of recent jobs
+        self.waits = deque(maxlen=history)
+        self.latencies = deque(maxlen=history)
+        self.output = JobOutput(sys.stdout)
+        for _ in range(pool_size):
+            threading.Thread(target=self.worker, daemon=True).start()
+    
+    def submit(self, request):
+        """Queue a job for `data` or `data_file` with solve `options`; raises ValueError or queue.Full."""
+        if not isinstance(request, dict) or ("data" in request) == ("data_file" in request):
+            raise ValueError("Request needs exactly one of 'data' or 'data_file'")
+        options = request.get("options", {})
+        if not isinstance(options, dict):
+            raise ValueError("'options' must be an object")
+        unknown = set(options) - SERVICE_OPTIONS
+        if unknown:
+            raise ValueError(f"Options not accepted by the service: {', '.join(sorted(unknown))}")
+        check_solve_options(**options)
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "status": "queued",
+            "name": request.get("name") or request.get("data_file") or "request",
+            "request": request,
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+            "results": None,
+            "error": None,
+            "log": io.StringIO(),
+            "scheduler": None
+        }
+        with self.lock:
+            self.queue.put_nowait(job)
+            self.jobs[job["id"]] = job
+            # Forget the oldest finished jobs beyond the history size
+            while len(self.jobs) > self.history:
+                oldest = next(iter(self.jobs.values()))
+                if oldest["status"] in ("queued", "running"):
+                    break
+                self.jobs.popitem(last=False)
+        return job
+    
+    def instance(self, request):
+        """Loaded TherapyScheduler for a request, from the instance cache if possible."""
+        if "data" in request:
+            key = hashlib.sha256(json.dumps(request["data"], sort_keys=True).encode()).hexdigest()
+        else:
+            key = (os.path.abspath(request["data_file"]), os.stat(request["data_file"]).st_mtime_ns)
+        with self.lock:
+            scheduler = self.instances.get(key)
+            if scheduler is not None:
+                self.instances.move_to_end(key)
+        if scheduler is None:
+            if "data" in request:
+                scheduler = TherapyScheduler(request.get("name") or "request", data=request["data"])
+            else:
+                scheduler = TherapyScheduler(request["data_file"])
+            with self.lock:
+                self.instances[key] = scheduler
+                while len(self.instances) > self.cache_entries:
+                    self.instances.popitem(last=False)
+        # A shallow copy gives each job its own solver state over the shared arrays
+        scheduler = copy.copy(scheduler)
+        scheduler.model_cache = self.model_cache
+        scheduler.stop_requested = False
+        scheduler.active_solver = None
+        return scheduler
+    
+    def worker(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                if job["status"] == "cancelled":
+                    continue
+                job["status"] = "running"
+                job["started"] = time.time()
+            self.output.local.log = job["log"]
+            try:
+                job["scheduler"] = self.instance(job["request"])
+                job["scheduler"].output = job["log"]
+                if job["status"] == "cancelled":
+                    job["scheduler"].stop()
+                options = {"time_limit": self.time_limit, "num_workers": self.num_workers,
+                           **job["request"].get("options", {})}
+                results = job["scheduler"].solve(**options)
+                with self.lock:
+                    if job["status"] == "running":
+                        job["results"] = results
+                        job["status"] = "done" if results else "failed"
+                        if not results:
+                            job["error"] = f"No solution ({job['scheduler'].last_status or 'NO_SOLUTION'})"
+            except Exception as error:
+                traceback.print_exc(file=job["log"])
+                with self.lock:
+                    job["status"] = "failed"
+                    job["error"] = f"{type(error).__name__}: {error}"
+            finally:
+                self.output.local.log = None
+                job["scheduler"] = None
+                job["finished"] = time.time()
+                self.waits.append(job["started"] - job["submitted"])
+                self.latencies.append(job["finished"] - job["submitted"])
+    
+    def cancel(self, job_id):
+        """Cancel a queued job, or stop the search of a running one."""
+        with self.lock:
+            job = self.jobs[job_id]
+            if job["status"] not in ("queued", "running"):
+                return job
+            running = job["status"] == "running"
+            job["status"] = "cancelled"
+            if not running:
+                job["finished"] = time.time()
+        scheduler = job["scheduler"]
+        if running and scheduler:
+            scheduler.stop()
+        return job
+    
+    def status(self, job):
+        """JSON-ready status of a job, without its results."""
+        summary = {key: job[key] for key in ("id", "name", "status", "submitted", "started", "finished", "error")}
+        if job["results"]:
+            summary.update(total_ri_minutes=job["results"]["total_ri_minutes"],
+                           solution_status=job["results"]["status"])
+        summary["log"] = job["log"].getvalue().splitlines()[-20:]
+        return summary
+    
+    def stats(self):
+        """Queue depth, job counts, cache use and latency percentiles of recent jobs."""
+        with self.lock:
+            counts = Counter(job["status"] for job in self.jobs.values())
+        
+        def percentiles(values):
+            if not values:
+                return None
+            p50, p90, p99 = np.percentile(list(values), [50, 90, 99])
+            return {"p50": p50, "p90": p90, "p99": p99, "max": max(values)}
+        
+        return {
+            "queue_depth": self.queue.qsize(),
+            "jobs": dict(counts),
+            "cached_instances": len(self.instances),
+            "cached_models": len(self.model_cache.entries),
+            "model_cache_hits": self.model_cache.hits,
+            "model_cache_misses": self.model_cache.misses,
+            "wait_seconds": percentiles(self.waits),
+            "latency_seconds": percentiles(self.latencies)
+        }
+
+class ServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP API of the scheduling service: submit, poll, fetch and cancel jobs, and report /stats."""
+    
+    service = None
+    
+    def send_json(self, code, payload):
+        body = json.dumps(payload, default=float).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def job(self, job_id):
+        job = self.service.jobs.get(job_id)
+        if job is None:
+            self.send_json(404, {"error": f"Unknown job {job_id}"})
+        return job
+    
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                job = self.service.submit(json.loads(self.rfile.read(length) or b"{}"))
+            except (ValueError, json.JSONDecodeError) as error:
+                return self.send_json(400, {"error": str(error)})
+            except queue.Full:
+                return self.send_json(503, {"error": "Job queue is full"})
+            return self.send_json(202, self.service.status(job))
+        if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+            return self.do_DELETE()
+        self.send_json(404, {"error": f"Unknown path {self.path}"})
+    
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["stats"]:
+            return self.send_json(200, self.service.stats())
+        if len(parts) in (2, 3) and parts[0] == "jobs" and parts[2:] in ([], ["result"]):
+            job = self.job(parts[1])
+            if job is None:
+                return
+            if parts[2:] == ["result"]:
+                if job["status"] != "done":
+                    return self.send_json(409, self.service.status(job))
+                return self.send_json(200, job["results"])
+            return self.send_json(200, self.service.status(job))
+        self.send_json(404, {"error": f"Unknown path {self.path}"})
+    
+    def do_DELETE(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            if self.job(parts[1]) is not None:
+                self.send_json(200, self.service.status(self.service.cancel(parts[1])))
+            return
+        self.send_json(404, {"error": f"Unknown path {self.path}"})
+    
+    def log_message(self, format, *args):
+        # The default includes the client address, which Unix sockets do not have
+        sys.stderr.write(f"[{self.log_date_time_string()}] {format % args}\n")
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Threaded HTTP server on a Unix socket."""
+    daemon_threads = True
+
+def serve(service, host='127.0.0.1', port=8765, socket_path=None):
+    """Serve the HTTP API of `service` on a TCP port or a Unix socket until interrupted."""
+    ServiceRequestHandler.service = service
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ServiceRequestHandler)
+        address = socket_path
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), ServiceRequestHandler)
+        address = f"http://{host}:{server.server_address[1]}"
+    print(f"Scheduling service listening on {address}")
+    stdout = sys.stdout
+    sys.stdout = service.output
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down")
+    finally:
+        sys.stdout = stdout
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog='therapy_scheduler.py serve', description='Run the scheduling service')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port to listen on (default: 8765)')
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--pool-size', type=int, help='Number of jobs solved at once (default: number of cores)')
+    parser.add_argument('--queue-size', type=int, default=100, help='Most jobs waiting in the queue (default: 100)')
+    parser.add_argument('--workers', '-w', type=int,
+                        help='CP-SAT search workers per job (default: cores divided by the pool size)')
+    parser.add_argument('--time-limit', '-t', type=float, default=60.0,
+                        help='Default time limit per job in seconds (default: 60)')
+    parser.add_argument('--cache-entries', type=int, default=32,
+                        help='Instances and models kept in memory (default: 32 each)')
+    args = parser.parse_args(argv)
+    
+    # Size the split by the requested pool so split_cores does not cap it at the core count
+    pool_size, num_workers = split_cores(args.pool_size or os.cpu_count() or 1, args.pool_size, args.workers)
+    service = SchedulingService(pool_size=pool_size, queue_size=args.queue_size, num_workers=num_workers,
+                                time_limit=args.time_limit, cache_entries=args.cache_entries)
+    print(f"Solving up to {pool_size} jobs at once with {num_workers} CP-SAT workers each")
+    serve(service, host=args.host, port=args.port, socket_path=args.socket)
+
+def convert_main(argv):
+    parser = argparse.ArgumentParser(prog='therapy_scheduler.py convert',
+                                     description='Convert JSON input files to the binary .npz format')
+    parser.add_argument('data_files', nargs='+', help='JSON input files')
+    parser.add_argument('--output', '-o', help='Output .npz file, for a single input (default: next to the input)')
+    args = parser.parse_args(argv)
+    if args.output and len(args.data_files) > 1:
+        parser.error('--output works with a single input file')
+    
+    for data_file in args.data_files:
+        try:
+            output_file = convert_instance(data_file, args.output)
+        except ValueError as error:
+            parser.error(str(error))
+        print(f"Converted {data_file} ({os.path.getsize(data_file) / 2**20:.1f} MB) to {output_file} "
+              f"({os.path.getsize(output_file) / 2**20:.1f} MB)")
+
 def main():
+    if sys.argv[1:2] == ['serve']:
+        return serve_main(sys.argv[2:])
+    if sys.argv[1:2] == ['convert']:
+        return convert_main(sys.argv[2:])
+    
     parser = argparse.ArgumentParser(description='Therapy Schedule Optimization')
-    parser.add_argument('data_file', help='Path to JSON data file')
+    parser.add_argument('data_file', help='Path to JSON data file; with --batch a directory, glob or manifest')
     parser.add_argument('--output', '-o', help='Path to output JSON file')
     parser.add_argument('--output-dir', '-d', default='results', help='Directory to save results (default: results)')
     parser.add_argument('--time-limit', '-t', type=float, default=300.0, help='Time limit in seconds (default: 300)')
+    parser.add_argument('--continuity', choices=['linear', 'legacy'], default='linear',
+                        help='Encoding of the session continuity constraint (default: linear)')
+    parser.add_argument('--backend', choices=['slots', 'intervals'], default='slots',
+                        help='Model backend: per-slot booleans or optional intervals (default: slots)')
+    parser.add_argument('--resolution', type=int,
+                        help='Time resolution in minutes for the intervals backend (default: slot length)')
+    parser.add_argument('--workers', '-w', type=int, help='Number of CP-SAT search workers (default: all cores)')
+    parser.add_argument('--relative-gap', type=float, help='Stop once the relative gap to the bound is below this value')
+    parser.add_argument('--absolute-gap', type=float, help='Stop once the absolute gap to the bound is below this value')
+    parser.add_argument('--incumbent-file', help='Write the best schedule found so far to this JSON file during the solve')
+    parser.add_argument('--hint-from', help='Previous results JSON whose schedule is used as a solution hint')
+    parser.add_argument('--freeze-before', type=parse_freeze_point,
+                        help='Pin the --hint-from sessions before DAY/SLOT (1-based, e.g. 3/1)')
+    parser.add_argument('--format', '-f', nargs='+', choices=['json', 'csv', 'parquet', 'npz'], default=['json'],
+                        dest='formats', help='Output formats for the results (default: json)')
+    parser.add_argument('--engine', choices=['cpsat', 'greedy', 'lns'], default='cpsat',
+                        help='Solve with CP-SAT, the greedy heuristic, or LNS from the greedy schedule (default: cpsat)')
+    parser.add_argument('--greedy-hint', action='store_const', const=True,
+                        help='Seed CP-SAT with the greedy schedule as a hint (default unless --hint-from is given)')
+    parser.add_argument('--no-greedy-hint', action='store_const', const=False, dest='greedy_hint',
+                        help='Start CP-SAT without the greedy hint')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for LNS neighborhoods (default: 0)')
+    parser.add_argument('--decompose', choices=['master', 'heuristic'],
+                        help='Solve by decomposition, picking therapists with a master model or a heuristic')
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='Number of processes for decomposition subproblems or batch jobs (default: all cores)')
+    parser.add_argument('--compare-monolithic', action='store_true',
+                        help='With --decompose, also solve the full model and report the gap to its bound')
+    parser.add_argument('--batch', action='store_true',
+                        help='Solve every instance of a directory, glob or manifest in a process pool')
+    parser.add_argument('--sweep', help='JSON file of staffing scenarios to compare on one model')
+    parser.add_argument('--objective-precision', type=int, default=2,
+                        help='Decimal digits of the efficiency factors kept in the integer objective (default: 2)')
+    parser.add_argument('--lexicographic', action='store_true',
+                        help='Maximize requirement coverage first, then RI minutes with coverage fixed')
+    parser.add_argument('--cache', action='store_true', help='Save built models in the model cache and reuse them')
+    parser.add_argument('--cache-dir', default='model_cache', help='Directory of the model cache (default: model_cache)')
+    parser.add_argument('--cache-size', type=float, default=1024,
+                        help='Size limit of the model cache in MB (default: 1024)')
+    parser.add_argument('--symmetry', action='store_true',
+                        help='Break symmetry between interchangeable therapists and patients')
+    parser.add_argument('--window-days', type=int,
+                        help='Plan in rolling windows of this many days, keeping therapists between windows')
+    parser.add_argument('--commit-days', type=int,
+                        help='Days committed per rolling window before it slides on (default: half the window)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time and size each constraint family and record peak memory and presolve statistics')
+    parser.add_argument('--profile-stats', help='With --profile, also write cProfile statistics of the run to this file')
     args = parser.parse_args()
+    if args.batch and (args.output or args.incumbent_file or args.hint_from):
+        parser.error('--batch writes to --output-dir; use manifest options for per-instance files')
+    if args.sweep and (args.batch or args.decompose or args.hint_from or args.engine != 'cpsat'
+                       or args.backend != 'slots' or args.lexicographic or args.window_days or args.symmetry):
+        parser.error('--sweep works with the slots backend and CP-SAT engine, without --decompose, --hint-from, '
+                     '--lexicographic, --window-days or --symmetry')
+    if args.profile_stats and not args.profile:
+        parser.error('--profile-stats requires --profile')
+    if args.profile and (args.batch or args.sweep or args.decompose or args.window_days or args.engine != 'cpsat'):
+        parser.error('--profile works with the CP-SAT engine, without --batch, --sweep, --decompose or --window-days')
+    options = {"time_limit": args.time_limit, "continuity": args.continuity, "backend": args.backend,
+               "resolution": args.resolution, "relative_gap": args.relative_gap,
+               "absolute_gap": args.absolute_gap, "decompose": args.decompose,
+               "compare_monolithic": args.compare_monolithic, "engine": args.engine,
+               "greedy_hint": args.greedy_hint, "seed": args.seed, "symmetry": args.symmetry,
+               "lexicographic": args.lexicographic, "objective_precision": args.objective_precision,
+               "window_days": args.window_days, "commit_days": args.commit_days}
+    try:
+        check_solve_options(incumbent_file=args.incumbent_file, hint_from=args.hint_from,
+                            freeze_before=args.freeze_before, **options)
+    except ValueError as error:
+        parser.error(str(error))
+    
+    # A cached model would hide the construction cost that --profile measures
+    model_cache = ModelCache(args.cache_dir, args.cache_size * 2**20) if args.cache and not args.profile else None
+    
+    if args.batch:
+        jobs = batch_jobs(args.data_file, options)
+        if not jobs:
+            parser.error(f"No input files found for '{args.data_file}'")
+        run_batch(jobs, args.output_dir, parallel_jobs=args.jobs, num_workers=args.workers, formats=args.formats,
+                  model_cache=model_cache)
+        return
     
     # Ensure the input directory exists
     input_dir = os.path.dirname(args.data_file)
@@ -443,11 +2809,44 @@ def main():
         file_basename = os.path.splitext(os.path.basename(args.data_file))[0]
         output_file = os.path.join(args.output_dir, f"schedule_{file_basename}.json")
     
+    profile = PhaseProfile() if args.profile else None
+    profiler = cProfile.Profile() if args.profile_stats else None
+    if profiler:
+        profiler.enable()
+    
     # Initialize scheduler with the data file
-    scheduler = TherapyScheduler(args.data_file)
-    # Store the data file path
-    scheduler.data_file = args.data_file
-    scheduler.run(time_limit=args.time_limit, output_file=output_file)
+    try:
+        with profile.phase('load') if profile else nullcontext():
+            scheduler = TherapyScheduler(args.data_file)
+    except ValueError as error:
+        parser.error(str(error))
+    scheduler.objective_precision = args.objective_precision
+    scheduler.model_cache = model_cache
+    scheduler.profile = profile
+    
+    if args.sweep:
+        with open(args.sweep, 'r') as f:
+            scenarios = json.load(f)
+        sweep = scheduler.sweep_staffing(scenarios, time_limit=args.time_limit, continuity=args.continuity,
+                                         num_workers=args.workers, jobs=args.jobs)
+        print()
+        print(sweep.to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+        file_basename = os.path.splitext(os.path.basename(args.data_file))[0]
+        scheduler.save_sweep(sweep, args.output or os.path.join(args.output_dir, f"sweep_{file_basename}.csv"))
+        return
+    
+    try:
+        scheduler.run(output_file=output_file, formats=args.formats, num_workers=args.workers,
+                      incumbent_file=args.incumbent_file, hint_from=args.hint_from,
+                      freeze_before=args.freeze_before, jobs=args.jobs, **options)
+    except ValueError as error:
+        # E.g. a --hint-from schedule that cannot be converted to the model's time units
+        parser.error(str(error))
+    
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile_stats)
+        print(f"cProfile statistics saved to {args.profile_stats}")
 
 if __name__ == "__main__":
     # Create input and results directories if they don't exist